@@ -5,19 +5,40 @@ With improved speaker diarization, language-specific transcription, and per-segm
 """
 
 import os
+import re
+import glob
 import json
+import logging
+import time
+import base64
+import datetime
+import hashlib
+import mmap
 import asyncio
 import tempfile
-import uuid
-from typing import Dict, List, Any
+import itertools
+import threading
+import urllib.parse
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, List, Any, Optional
 from pathlib import Path
 
+import aiofiles
+import av
+import orjson
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import httpx
 import google.generativeai as genai
-from pydantic import BaseModel
+from google.api_core import exceptions as google_exceptions
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
 
 
 # Configuration
@@ -27,15 +48,58 @@ LABEL_STUDIO_URL = os.getenv("LABEL_STUDIO_URL", "http://localhost:8080")
 LABEL_STUDIO_API_KEY = os.getenv("LABEL_STUDIO_API_KEY", "")
 PORT = int(os.getenv("PORT", "9090"))
 HOST = os.getenv("HOST", "0.0.0.0")
+WORKERS = int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", "4")))  # uvicorn worker processes
+# Analysis results cache keyed by audio content; set to an empty string to disable
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", os.path.expanduser("~/.cache/ls-gemini"))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds; 0 keeps entries forever
+# Uploaded Gemini files kept for reuse; evicted uploads are deleted from Gemini
+GEMINI_UPLOAD_CACHE_SIZE = int(os.getenv("GEMINI_UPLOAD_CACHE_SIZE", "64"))
+# Keep the analysis prompt in a Gemini context cache (opt-in; cache storage is billed per hour)
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))  # Seconds
+# Gemini rejects context caches below a model-specific token count (32768 for 1.5/2.0 models)
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "32768"))
+PROMPTS_DIR = Path(os.getenv("PROMPTS_DIR", Path(__file__).with_name("prompts")))  # Prompt text files
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "8"))  # Parallel tasks per /predict batch
+GEMINI_WORKERS = int(os.getenv("GEMINI_WORKERS", "8"))  # Threads for blocking Gemini SDK calls
+# Scratch space for downloads and clips; point at a tmpfs (e.g. /dev/shm) to keep
+# intermediate audio off the disk, but make sure it is large enough
+TEMP_DIR = os.getenv("TEMP_DIR") or None
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG also logs download steps and transcripts
+
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger("enhanced_api")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Share one pooled HTTP client for Label Studio token refreshes and downloads"""
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
 
 
 # Initialize FastAPI
 app = FastAPI(
     title="Enhanced Label Studio Audio ML Backend",
     description="Advanced audio analysis with speaker diarization and language-specific transcription",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Bounds concurrent Gemini work so large batches don't exhaust API quota
+_task_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+# Dedicated pool for the synchronous Gemini SDK so it never blocks the event loop
+_gemini_pool = ThreadPoolExecutor(max_workers=GEMINI_WORKERS, thread_name_prefix="gemini")
+
 # Add CORS
 app.add_middleware(
     CORSMiddleware,
@@ -47,145 +111,148 @@ app.add_middleware(
 
 
 # Initialize Gemini
-def init_gemini():
-    """Initialize Gemini AI model"""
+if GEMINI_API_KEY:
+    genai.configure(api_key=GEMINI_API_KEY)
+
+_model_lock = threading.Lock()
+
+
+# Configure safety settings to be less restrictive
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
+]
+
+MAX_OUTPUT_TOKENS = 16384
+
+# Output budget per second of audio (JSON segments with transcript and attributes),
+# never below the floor so short clips still have room for the surrounding JSON
+OUTPUT_TOKENS_PER_SECOND = 80
+MIN_OUTPUT_TOKENS = 2048
+
+GENERATION_CONFIG = genai.types.GenerationConfig(
+    temperature=0.1,  # Low temperature for consistent results
+    max_output_tokens=MAX_OUTPUT_TOKENS,
+    response_mime_type="application/json"
+)
+
+
+@lru_cache(maxsize=1)
+def _build_model():
+    """Build the Gemini model (runs once per process)"""
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY environment variable is required")
     
-    genai.configure(api_key=GEMINI_API_KEY)
-    
     # Using Gemini model from environment configuration
     model_name = GEMINI_MODEL  # Gets model from .env file
-    print(f"Using Gemini model: {model_name}")
-    
-    # Configure safety settings to be less restrictive
-    safety_settings = [
-        {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-        {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"},
-    ]
+    logger.info("Using Gemini model: %s", model_name)
     
     model = genai.GenerativeModel(
         model_name,
-        generation_config=genai.types.GenerationConfig(
-            temperature=0.1,  # Low temperature for consistent results
-            max_output_tokens=16384,
-            response_mime_type="application/json"
-        ),
-        safety_settings=safety_settings
+        generation_config=GENERATION_CONFIG,
+        safety_settings=SAFETY_SETTINGS
     )
     return model
 
 
-# Enhanced analysis prompt - English with robust requirements  
-ENHANCED_ANALYSIS_PROMPT = """
-You are an expert audio analyst. Perform a COMPREHENSIVE and PRECISE analysis of this audio file.
-
-CRITICAL REQUIREMENTS - FOLLOW WITH EXTREME ACCURACY:
-
-1. SPEAKER DIARIZATION (MUST BE PERFECT):
-   - Identify EVERY unique speaker and assign consistent IDs: "Speaker 1", "Speaker 2", etc.
-   - Track the SAME speaker throughout the ENTIRE audio - never mix speakers
-   - Mark speaker changes with EXACT timestamps (precision to 0.1 seconds)
-   - If uncertain about speaker identity, create a NEW speaker ID
-   - Pay attention to: voice pitch, tone, accent, speaking style, breathing patterns
-
-2. TIMING PRECISION (CRITICAL):
-   - Provide EXACT start_time and end_time in seconds (e.g., 0.0, 3.7, 15.2)
-   - NO gaps between segments - continuous coverage required
-   - NO overlapping segments allowed
-   - Minimum segment duration: 0.5 seconds
-   - Maximum segment duration: 30 seconds (split longer speech appropriately)
-   - Total coverage must equal audio duration
-
-3. TRANSCRIPTION ACCURACY (WORD-PERFECT):
-   - Transcribe EXACTLY what is said, including:
-     * Hesitations (um, uh, er)
-     * Repetitions and false starts
-     * Incomplete words or sentences
-   - Use CORRECT script for each language:
-     * Uzbek: Latin script with proper apostrophes (o', g', ng) - e.g., "O'zbekiston", "yaxshi", "to'g'ri"
-     * Russian: Cyrillic script - e.g., "правильно", "хорошо"
-     * Arabic: Arabic script - e.g., "العربية", "مرحبا"
-     * English: Latin script
-     * Turkish: Latin with Turkish characters (ğ, ş, ı, ö, ü, ç)
-   - Preserve code-switching and mixed languages
-
-4. LANGUAGE DETECTION (PER SEGMENT):
-   - Identify the PRIMARY language of each segment
-   - Use codes: "Uzbek", "Russian", "Arabic", "English", "Turkish", "Other"
-   - For mixed segments, choose the DOMINANT language (>60% of words)
-   - Be consistent - if speaker uses same language, keep it consistent
-
-5. GENDER IDENTIFICATION (ACCURATE):
-   - Analyze voice characteristics:
-     * Fundamental frequency: Male (85-180 Hz), Female (165-255 Hz)
-     * Vocal tract length and formants
-     * Speaking patterns and intonation
-   - Options: "Male", "Female", "Unknown"
-   - Use "Unknown" ONLY when truly ambiguous or child voice
-
-6. EMOTION DETECTION (NUANCED):
-   - Detect PRIMARY emotion based on:
-     * Pitch variations and prosody
-     * Speaking rate and rhythm
-     * Volume and intensity
-     * Voice quality (breathy, tense, creaky)
-   - Emotions: "Neutral", "Happy", "Sad", "Angry", "Surprised", "Fearful", 
-              "Disgusted", "Excited", "Calm", "Frustrated", "Confident"
-   - Choose most prominent emotion, not just default to "Neutral"
-
-7. SUMMARY GENERATION (DETAILED IN UZBEK LATIN):
-   - Write in Uzbek Latin script ONLY
-   - Include:
-     * Asosiy mavzular (main topics discussed)
-     * Har bir spiker nimani aytdi (what each speaker said)
-     * Muhim nuqtalar va xulosalar (key points and conclusions)
-     * Suhbat ohangi va kayfiyati (conversation tone and mood)
-     * Qaror yoki kelishuvlar (decisions or agreements)
-   - Length: 4-8 sentences with substantive content
-
-STRICT JSON OUTPUT FORMAT:
-{
-    "segments": [
-        {
-            "speaker_id": "Speaker 1",
-            "start_time": 0.0,
-            "end_time": 5.3,
-            "text": "Exact transcription in appropriate script",
-            "language": "Uzbek",
-            "gender": "Male",
-            "emotion": "Neutral",
-            "confidence": 0.95
-        }
-    ],
-    "speakers": [
-        {
-            "id": "Speaker 1",
-            "total_speaking_time": 45.3,
-            "gender": "Male",
-            "primary_language": "Uzbek",
-            "segments_count": 12
-        }
-    ],
-    "summary_uzbek": "Detailed summary in Uzbek Latin script...",
-    "total_duration": 120.5,
-    "languages_detected": ["Uzbek", "Russian"],
-    "dominant_emotion": "Neutral"
-}
-
-QUALITY CONTROL CHECKLIST:
-✓ All speakers correctly identified and tracked
-✓ Timestamps are precise and continuous
-✓ Transcription is word-perfect in correct scripts
-✓ Languages accurately detected
-✓ Gender identification is reliable
-✓ Emotions are nuanced, not just "Neutral"
-✓ Summary is comprehensive and in Uzbek Latin
-
-Return ONLY valid JSON. No explanations or additional text.
-"""
+def _get_model():
+    """Return the shared Gemini model, building it on first use"""
+    # Analysis runs in worker threads, so serialize the first (uncached) build
+    with _model_lock:
+        return _build_model()
+
+
+# Context cache holding ENHANCED_ANALYSIS_PROMPT so requests only send the audio
+_prompt_cache = {"model": None, "expires_at": 0.0, "retry_at": 0.0, "creating": False}
+_prompt_cache_lock = threading.Lock()
+
+
+def _create_prompt_cache():
+    """Create the Gemini context cache for the analysis prompt (network call)"""
+    cached = genai.caching.CachedContent.create(
+        model=GEMINI_MODEL if GEMINI_MODEL.startswith("models/") else f"models/{GEMINI_MODEL}",
+        display_name="enhanced-analysis-prompt",
+        contents=[ENHANCED_ANALYSIS_PROMPT],
+        ttl=datetime.timedelta(seconds=GEMINI_CONTEXT_CACHE_TTL)
+    )
+    model = genai.GenerativeModel.from_cached_content(
+        cached,
+        generation_config=GENERATION_CONFIG,
+        safety_settings=SAFETY_SETTINGS
+    )
+    logger.info("Created Gemini context cache %s", cached.name)
+    return model, cached.expire_time.timestamp()
+
+
+def _get_analysis_model():
+    """Return (model, prompt_is_cached) for the main analysis call
+    
+    With GEMINI_CONTEXT_CACHE enabled the analysis prompt lives in a Gemini
+    context cache, refreshed shortly before its TTL runs out. One thread
+    creates the cache while the others keep using the plain model; if creation
+    fails the plain model is used and creation is retried after 5 minutes.
+    """
+    if not _PROMPT_CACHEABLE:
+        return _get_model(), False
+    
+    with _prompt_cache_lock:
+        now = time.time()
+        if _prompt_cache["model"] is not None and now < _prompt_cache["expires_at"] - 60:
+            return _prompt_cache["model"], True
+        if _prompt_cache["creating"] or now < _prompt_cache["retry_at"]:
+            return _get_model(), False
+        _prompt_cache["creating"] = True
+    
+    # Create outside the lock so other analyses aren't held up by the network call
+    try:
+        model, expires_at = _create_prompt_cache()
+    except Exception as e:
+        logger.warning("Could not create Gemini context cache: %s", e)
+        model, expires_at = None, 0.0
+    
+    with _prompt_cache_lock:
+        _prompt_cache.update(model=model, expires_at=expires_at, creating=False)
+        if model is None:
+            _prompt_cache["retry_at"] = time.time() + 300
+    
+    return (model, True) if model is not None else (_get_model(), False)
+
+
+def init_gemini():
+    """Initialize Gemini AI model (kept for backward compatibility)"""
+    return _get_model()
+
+
+# Enhanced analysis prompt - English with robust requirements (src/prompts/enhanced.txt)
+ENHANCED_ANALYSIS_PROMPT = (PROMPTS_DIR / "enhanced.txt").read_text(encoding="utf-8")
+PROMPT_HASH = hashlib.sha256(ENHANCED_ANALYSIS_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# Rough size check (~4 characters per token) so a prompt Gemini would refuse to cache
+# isn't retried every few minutes
+_PROMPT_CACHEABLE = GEMINI_CONTEXT_CACHE and len(ENHANCED_ANALYSIS_PROMPT) // 4 >= GEMINI_CONTEXT_CACHE_MIN_TOKENS
+if GEMINI_CONTEXT_CACHE and not _PROMPT_CACHEABLE:
+    logger.warning("GEMINI_CONTEXT_CACHE ignored: the analysis prompt is below GEMINI_CONTEXT_CACHE_MIN_TOKENS (%s)",
+                   GEMINI_CONTEXT_CACHE_MIN_TOKENS)
+
+# Shorter fallback prompt used when the full one trips the safety filters (src/prompts/simple.txt)
+SIMPLE_ANALYSIS_PROMPT = (PROMPTS_DIR / "simple.txt").read_text(encoding="utf-8").strip()
+
+
+# Access token obtained from the refresh token, reused until shortly before it expires
+_token_cache = {"access": None, "expires_at": 0.0}
+_token_lock = asyncio.Lock()
+
+
+def _jwt_expiry(token: str) -> float:
+    """Read the `exp` claim from a JWT without verifying it (0.0 if unavailable)"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload)).get("exp", 0))
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return 0.0
 
 
 async def get_access_token():
@@ -197,9 +264,12 @@ async def get_access_token():
     
     # If it's a JWT refresh token, try to get an access token
     if LABEL_STUDIO_API_KEY.startswith("eyJ"):
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
+        async with _token_lock:
+            if _token_cache["access"] and time.time() < _token_cache["expires_at"] - 30:
+                return _token_cache["access"]
+            
+            try:
+                response = await app.state.http.post(
                     f"{LABEL_STUDIO_URL}/api/token/refresh/",
                     json={"refresh": LABEL_STUDIO_API_KEY},
                     timeout=10.0
@@ -208,27 +278,163 @@ async def get_access_token():
                     data = response.json()
                     access_token = data.get("access")
                     if access_token:
-                        print(f"Got access token from refresh token")
+                        logger.debug("Got access token from refresh token")
+                        _token_cache["access"] = access_token
+                        _token_cache["expires_at"] = _jwt_expiry(access_token)
                         return access_token
-        except Exception as e:
-            print(f"Could not refresh token: {e}")
+            except Exception as e:
+                logger.warning("Could not refresh token: %s", e)
     
     # Return original token if refresh fails or it's not a JWT
     return LABEL_STUDIO_API_KEY
 
 
-async def download_audio(url: str) -> str:
-    """Download audio file from URL or handle local file"""
-    import re
-    import glob
-    import urllib.parse
+# Label Studio media storage location
+LABEL_STUDIO_MEDIA_ROOT = os.path.expanduser("~/.local/share/label-studio/media")
 
-    print(f"[download_audio] Processing URL: {url}")
 
+@lru_cache(maxsize=1)
+def _project_dirs(ts_bucket: int) -> List[str]:
+    """List Label Studio upload project directories (cached per 30s time bucket)"""
     try:
-        # Label Studio media storage location
-        LABEL_STUDIO_MEDIA_ROOT = os.path.expanduser("~/.local/share/label-studio/media")
+        with os.scandir(os.path.join(LABEL_STUDIO_MEDIA_ROOT, "upload")) as entries:
+            return [entry.path for entry in entries if entry.is_dir()]
+    except OSError:
+        return []
+
+
+def _find_in_dir(directory: str, filename: str) -> Optional[str]:
+    """Return the first file in directory whose name contains filename"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if filename in entry.name and entry.is_file():
+                    return entry.path
+    except OSError:
+        pass
+    return None
+
+
+# Read size for streamed audio downloads
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Label Studio URL patterns used by download_audio
+_HOST_RE = re.compile(r'^https?://[^/]+')
+_UPLOAD_RE = re.compile(r'/data/upload/(\d+)/(.+?)(?:\?|$)')
+_LOCAL_FILES_RE = re.compile(r'/data/local-files/\?d=(.+?)(?:&|$)')
+_FILENAME_RE = re.compile(r'([^/]+\.(?:mp3|wav|ogg|flac|m4a))(?:\?|$)', re.IGNORECASE)
+
+
+def _resolve_absolute(url: str) -> Optional[str]:
+    """Absolute path that already exists"""
+    if os.path.exists(url):
+        logger.debug("[download_audio] Found absolute path: %s", url)
+        return url
+    return None
+
+
+def _resolve_file_uri(url: str) -> Optional[str]:
+    """file:// URL pointing at a local file"""
+    local_path = url[7:]  # Remove 'file://' prefix
+    if os.path.exists(local_path):
+        logger.debug("[download_audio] Found file:// at: %s", local_path)
+        return local_path
+    return None
+
+
+def _resolve_upload(url: str) -> Optional[str]:
+    """Label Studio upload URL: /data/upload/{project_id}/{filename}"""
+    data_upload_match = _UPLOAD_RE.search(url)
+    if not data_upload_match:
+        return None
+    project_id = data_upload_match.group(1)
+    filename = urllib.parse.unquote(data_upload_match.group(2))
+    local_path = os.path.join(LABEL_STUDIO_MEDIA_ROOT, "upload", project_id, filename)
+    logger.debug("[download_audio] Trying upload path: %s", local_path)
+    if os.path.exists(local_path):
+        logger.debug("[download_audio] Found Label Studio media file: %s", local_path)
+        return local_path
+    # Try to find by partial filename match
+    search_pattern = os.path.join(LABEL_STUDIO_MEDIA_ROOT, "upload", project_id, f"*{filename.split('/')[-1]}*")
+    matches = glob.glob(search_pattern)
+    if matches:
+        logger.debug("[download_audio] Found by pattern match: %s", matches[0])
+        return matches[0]
+    return None
+
+
+def _resolve_local_files(url: str) -> Optional[str]:
+    """Label Studio local storage URL: /data/local-files/?d=path"""
+    local_files_match = _LOCAL_FILES_RE.search(url)
+    if not local_files_match:
+        return None
+    file_path = urllib.parse.unquote(local_files_match.group(1))
+    logger.debug("[download_audio] Trying local-files path: %s", file_path)
+    if os.path.exists(file_path):
+        return file_path
+    return None
+
+
+def _resolve_by_filename(url: str) -> Optional[str]:
+    """Search all upload project directories for the URL's audio filename"""
+    filename_match = _FILENAME_RE.search(url)
+    if not filename_match:
+        return None
+    filename = urllib.parse.unquote(filename_match.group(1))
+    logger.debug("[download_audio] Searching for filename: %s", filename)
+    for project_dir in _project_dirs(int(time.time() // 30)):
+        # Exact match is a single stat, so try it before listing the directory
+        exact_path = os.path.join(project_dir, filename)
+        if os.path.exists(exact_path):
+            logger.debug("[download_audio] Found exact match: %s", exact_path)
+            return exact_path
+        match = _find_in_dir(project_dir, filename)
+        if match:
+            logger.debug("[download_audio] Found file by name search: %s", match)
+            return match
+    return None
+
+
+def _resolve_bare_filename(url: str) -> Optional[str]:
+    """Plain filename (like test.mp3) under the local audio directory"""
+    local_path = f"/mnt/mata/labelStudio/{url}"
+    if os.path.exists(local_path):
+        logger.debug("[download_audio] Found local file at: %s", local_path)
+        return local_path
+    return None
+
+
+def _resolve_mounted(url: str) -> Optional[str]:
+    """Path relative to the local audio directory"""
+    for path in (f"/mnt/mata/labelStudio{url}", f"/mnt/mata/labelStudio/{url.lstrip('/')}"):
+        if os.path.exists(path):
+            logger.debug("[download_audio] Found local file at: %s", path)
+            return path
+    return None
+
+
+# (applies, resolver) pairs tried in order on the host-stripped URL; cheap string
+# checks decide which resolvers run, so most URLs skip the regexes and stat calls
+_LOCAL_RESOLVERS = [
+    (lambda url: url.startswith("/"), _resolve_absolute),
+    (lambda url: url.startswith("file://"), _resolve_file_uri),
+    (lambda url: "/data/upload/" in url, _resolve_upload),
+    (lambda url: "/data/local-files/" in url, _resolve_local_files),
+    (lambda url: True, _resolve_by_filename),
+    (lambda url: not url.startswith(("http://", "https://", "file://", "/")), _resolve_bare_filename),
+    (lambda url: url.startswith("/"), _resolve_mounted),
+]
+
+
+async def download_audio(url: str, tmpdir: Optional[str] = None) -> str:
+    """Download audio file from URL or handle local file
+    
+    Downloads are written into `tmpdir` so the caller owns their cleanup;
+    local files are returned in place.
+    """
+    logger.debug("[download_audio] Processing URL: %s", url)
 
+    try:
         # Handle blob URLs - these can't be downloaded server-side
         if url.startswith("blob:"):
             raise HTTPException(
@@ -237,94 +443,18 @@ async def download_audio(url: str) -> str:
             )
 
         # Strip http://localhost:PORT prefix if present - convert to relative path
-        url = re.sub(r'^https?://[^/]+', '', url)
-        print(f"[download_audio] Normalized URL: {url}")
-
-        # First check if it's an absolute path that already exists
-        if url.startswith("/") and os.path.exists(url):
-            print(f"[download_audio] Found absolute path: {url}")
-            return url
-
-        # Check for Label Studio data URLs - map to local filesystem
-        # Formats: /data/upload/{project_id}/{filename}, /data/local-files/?d=path
-
-        # Pattern 1: /data/upload/{project_id}/{filename}
-        data_upload_match = re.search(r'/data/upload/(\d+)/(.+?)(?:\?|$)', url)
-        if data_upload_match:
-            project_id = data_upload_match.group(1)
-            filename = urllib.parse.unquote(data_upload_match.group(2))
-            local_path = os.path.join(LABEL_STUDIO_MEDIA_ROOT, "upload", project_id, filename)
-            print(f"[download_audio] Trying upload path: {local_path}")
-            if os.path.exists(local_path):
-                print(f"[download_audio] Found Label Studio media file: {local_path}")
-                return local_path
-            # Try to find by partial filename match
-            search_pattern = os.path.join(LABEL_STUDIO_MEDIA_ROOT, "upload", project_id, f"*{filename.split('/')[-1]}*")
-            matches = glob.glob(search_pattern)
-            if matches:
-                print(f"[download_audio] Found by pattern match: {matches[0]}")
-                return matches[0]
-
-        # Pattern 2: /data/local-files/?d=path
-        local_files_match = re.search(r'/data/local-files/\?d=(.+?)(?:&|$)', url)
-        if local_files_match:
-            file_path = urllib.parse.unquote(local_files_match.group(1))
-            print(f"[download_audio] Trying local-files path: {file_path}")
-            if os.path.exists(file_path):
-                return file_path
-
-        # Pattern 3: Extract filename and search in all upload directories
-        filename_match = re.search(r'([^/]+\.(?:mp3|wav|ogg|flac|m4a))(?:\?|$)', url, re.IGNORECASE)
-        if filename_match:
-            filename = urllib.parse.unquote(filename_match.group(1))
-            print(f"[download_audio] Searching for filename: {filename}")
-            # Search in all project upload directories
-            for project_dir in glob.glob(os.path.join(LABEL_STUDIO_MEDIA_ROOT, "upload", "*")):
-                search_path = os.path.join(project_dir, f"*{filename}*")
-                matches = glob.glob(search_path)
-                if matches:
-                    print(f"[download_audio] Found file by name search: {matches[0]}")
-                    return matches[0]
-                # Also try exact match
-                exact_path = os.path.join(project_dir, filename)
-                if os.path.exists(exact_path):
-                    print(f"[download_audio] Found exact match: {exact_path}")
-                    return exact_path
-
-        # Check if it's just a filename (like test.mp3)
-        if not url.startswith(("http://", "https://", "file://", "/")):
-            local_path = f"/mnt/mata/labelStudio/{url}"
-            if os.path.exists(local_path):
-                print(f"[download_audio] Found local file at: {local_path}")
-                return local_path
-
-        # Check if it's a local file reference starting with /
-        if url.startswith("/") and not url.startswith(("http://", "https://")):
-            # Try various path combinations
-            paths_to_try = [
-                url,
-                f"/mnt/mata/labelStudio{url}",
-                f"/mnt/mata/labelStudio/{url.lstrip('/')}",
-            ]
-            for path in paths_to_try:
-                if os.path.exists(path):
-                    print(f"[download_audio] Found local file at: {path}")
-                    return path
-
-        # Check if it's file:// URL
-        if url.startswith("file://"):
-            local_path = url[7:]  # Remove 'file://' prefix
-            if os.path.exists(local_path):
-                print(f"[download_audio] Found file:// at: {local_path}")
-                return local_path
+        url = _HOST_RE.sub('', url)
+        logger.debug("[download_audio] Normalized URL: %s", url)
 
-        # Last resort: Try to download from URL
-        print(f"[download_audio] Attempting HTTP download for: {url}")
+        # Try only the local resolvers that apply to this kind of URL
+        for applies, resolve in _LOCAL_RESOLVERS:
+            if applies(url):
+                local_path = resolve(url)
+                if local_path:
+                    return local_path
 
-        # Create temporary file for download
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        temp_path = temp_file.name
-        temp_file.close()
+        # Last resort: Try to download from URL
+        logger.debug("[download_audio] Attempting HTTP download for: %s", url)
 
         # Construct full URL if needed
         download_url = url
@@ -334,43 +464,49 @@ async def download_audio(url: str) -> str:
             else:
                 download_url = f"{LABEL_STUDIO_URL}/data/{url}"
 
-        print(f"[download_audio] Download URL: {download_url}")
+        logger.debug("[download_audio] Download URL: %s", download_url)
 
-        # Download file with retries
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            headers = {}
-
-            # Get access token (handles refresh if needed)
-            token = await get_access_token()
-            if token:
-                if token.startswith("eyJ"):
-                    headers["Authorization"] = f"Bearer {token}"
-                else:
-                    headers["Authorization"] = f"Token {token}"
-
-            try:
-                response = await client.get(download_url, headers=headers, follow_redirects=True)
-                response.raise_for_status()
+        # Download file over the shared connection pool
+        headers = {}
 
-                with open(temp_path, "wb") as f:
-                    f.write(response.content)
+        # Get access token (handles refresh if needed)
+        token = await get_access_token()
+        if token:
+            if token.startswith("eyJ"):
+                headers["Authorization"] = f"Bearer {token}"
+            else:
+                headers["Authorization"] = f"Token {token}"
 
-                print(f"[download_audio] Downloaded to: {temp_path}")
-                return temp_path
+        # Create temporary file for download and write through its descriptor directly
+        fd, temp_path = tempfile.mkstemp(dir=tmpdir or TEMP_DIR, suffix=".mp3")
 
-            except httpx.HTTPStatusError as e:
-                print(f"[download_audio] HTTP error {e.response.status_code}: {e}")
-                os.unlink(temp_path)
-                raise
-            except Exception as e:
-                print(f"[download_audio] Download error: {e}")
-                os.unlink(temp_path)
-                raise
+        try:
+            # aiofiles runs the writes in a thread so parallel downloads keep overlapping
+            async with aiofiles.open(fd, "wb") as f:
+                # Stream to disk so large files never sit fully in memory
+                async with app.state.http.stream(
+                    "GET", download_url, headers=headers, follow_redirects=True
+                ) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                        await f.write(chunk)
+
+            logger.debug("[download_audio] Downloaded to: %s", temp_path)
+            return temp_path
+
+        except httpx.HTTPStatusError as e:
+            logger.warning("[download_audio] HTTP error %s: %s", e.response.status_code, e)
+            os.unlink(temp_path)
+            raise
+        except Exception as e:
+            logger.warning("[download_audio] Download error: %s", e)
+            os.unlink(temp_path)
+            raise
 
     except HTTPException:
         raise
     except Exception as e:
-        print(f"[download_audio] Error: {str(e)}")
+        logger.error("[download_audio] Error: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to download audio: {str(e)}")
 
 
@@ -396,81 +532,292 @@ def get_fallback_response() -> Dict[str, Any]:
     }
 
 
-def analyze_audio_with_gemini(audio_path: str) -> Dict[str, Any]:
+def _file_sha256(path: str) -> str:
+    """SHA-256 of a file, memoized while its size and mtime are unchanged"""
+    st = os.stat(path)
+    return _sha256_of(path, st.st_size, st.st_mtime_ns)
+
+
+@lru_cache(maxsize=256)
+def _sha256_of(path: str, size: int, mtime_ns: int) -> str:
+    """SHA-256 of a file without reading it into a Python bytes object"""
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        hasher = hashlib.sha256()
+        if os.fstat(f.fileno()).st_size:  # mmap rejects empty files
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+        return hasher.hexdigest()
+
+
+# Gemini File API uploads keyed by content hash, least recently used first
+_uploads: "OrderedDict[str, tuple]" = OrderedDict()
+_uploads_lock = threading.Lock()
+
+# Gemini deletes uploaded files after 48 hours; stop reusing them a bit earlier
+_UPLOAD_MAX_AGE = 46 * 3600
+
+# How long to wait for a reused upload that Gemini is still processing
+_UPLOAD_POLL_INTERVAL = 1.0
+_UPLOAD_POLL_TIMEOUT = 60.0
+
+
+def _delete_upload(audio_file):
+    """Best-effort removal of an uploaded file from Gemini"""
+    try:
+        genai.delete_file(audio_file.name)
+    except Exception as e:
+        logger.warning("Could not delete uploaded Gemini file %s: %s", audio_file.name, e)
+
+
+def _wait_for_upload(audio_file):
+    """Poll an uploaded file until Gemini finishes processing it (or the wait times out)"""
+    deadline = time.monotonic() + _UPLOAD_POLL_TIMEOUT
+    while audio_file.state.name != "ACTIVE":
+        audio_file = genai.get_file(audio_file.name)
+        if audio_file.state.name != "PROCESSING" or time.monotonic() >= deadline:
+            break
+        time.sleep(_UPLOAD_POLL_INTERVAL)
+    return audio_file
+
+
+def _upload_audio(audio_path: str):
+    """Upload audio to Gemini, reusing an earlier upload of identical content"""
+    digest = _file_sha256(audio_path)
+    
+    with _uploads_lock:
+        cached = _uploads.get(digest)
+        if cached is not None:
+            _uploads.move_to_end(digest)
+    
+    if cached is not None:
+        audio_file, uploaded_at = cached
+        if time.time() - uploaded_at < _UPLOAD_MAX_AGE:
+            # A concurrent request may still be waiting on this upload; only a
+            # failed one is worth replacing
+            audio_file = _wait_for_upload(audio_file)
+            if audio_file.state.name != "FAILED":
+                return audio_file
+        # Expired or failed upload: forget it and upload again
+        with _uploads_lock:
+            _uploads.pop(digest, None)
+        _delete_upload(audio_file)
+    
+    audio_file = genai.upload_file(audio_path, mime_type=_audio_mime_type(audio_path))
+    
+    evicted = []
+    with _uploads_lock:
+        _uploads[digest] = (audio_file, time.time())
+        while len(_uploads) > GEMINI_UPLOAD_CACHE_SIZE:
+            evicted.append(_uploads.popitem(last=False)[1][0])
+    for old_file in evicted:
+        _delete_upload(old_file)
+    
+    return audio_file
+
+
+def _analysis_cache_path(audio_path: str) -> Optional[Path]:
+    """Cache file for this audio content + model + prompt (None if caching is disabled)"""
+    if not ANALYSIS_CACHE_DIR:
+        return None
+    digest = _file_sha256(audio_path)
+    model_tag = GEMINI_MODEL.replace("/", "_")
+    return Path(ANALYSIS_CACHE_DIR) / f"{digest}-{model_tag}-{PROMPT_HASH}.json"
+
+
+def _load_cached_analysis(cache_path: Optional[Path]) -> Optional[Dict[str, Any]]:
+    """Return a previously stored analysis, or None on miss"""
+    if cache_path is None:
+        return None
+    try:
+        if ANALYSIS_CACHE_TTL and time.time() - cache_path.stat().st_mtime > ANALYSIS_CACHE_TTL:
+            cache_path.unlink(missing_ok=True)
+            return None
+        return orjson.loads(cache_path.read_bytes())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+
+def _store_cached_analysis(cache_path: Optional[Path], analysis: Dict[str, Any]):
+    """Atomically write an analysis to the cache (best effort)"""
+    if cache_path is None:
+        return
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(analysis))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning("Could not write analysis cache %s: %s", cache_path, e)
+
+
+# Gemini's quota errors say "Please retry in 12.5s"
+_RETRY_IN_RE = re.compile(r'retry in ([\d.]+)\s*s', re.IGNORECASE)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Rate-limit and transient server errors worth retrying with backoff"""
+    if isinstance(exc, (google_exceptions.TooManyRequests, google_exceptions.ServiceUnavailable,
+                        google_exceptions.InternalServerError, google_exceptions.DeadlineExceeded)):
+        return True
+    return "429" in str(exc) or "503" in str(exc)
+
+
+def _retry_after_seconds(exc: Optional[BaseException]) -> float:
+    """Server-requested delay from RetryInfo details, a Retry-After header or the message"""
+    if exc is None:
+        return 0.0
+    for detail in getattr(exc, "details", None) or []:
+        retry_delay = getattr(detail, "retry_delay", None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    response = getattr(exc, "response", None)
+    retry_after = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    match = _RETRY_IN_RE.search(str(exc))
+    return float(match.group(1)) if match else 0.0
+
+
+_backoff = wait_random_exponential(min=1, max=60)
+
+
+def _output_token_budget(audio_path: str) -> Optional[int]:
+    """max_output_tokens scaled to the audio's duration (None if it can't be read)"""
+    try:
+        with av.open(audio_path) as container:
+            duration = container.duration / av.time_base if container.duration else 0
+    except (av.error.FFmpegError, OSError):
+        return None
+    if not duration:
+        return None
+    return min(MAX_OUTPUT_TOKENS, max(MIN_OUTPUT_TOKENS, int(duration * OUTPUT_TOKENS_PER_SECOND)))
+
+
+def _generate(model, parts: List[Any], max_output_tokens: Optional[int] = None):
+    """model.generate_content with jittered exponential backoff on 429/5xx
+    
+    Waits at least as long as the server asks for when it sends a retry hint.
+    `max_output_tokens` overrides the model's limit for this call only.
+    """
+    overrides = {"generation_config": {"max_output_tokens": max_output_tokens}} if max_output_tokens else {}
+
+    for attempt in Retrying(
+        stop=stop_after_attempt(5),
+        wait=lambda state: max(_backoff(state), _retry_after_seconds(state.outcome.exception())),
+        retry=retry_if_exception(_is_retryable),
+        before_sleep=lambda state: logger.warning(
+            "Gemini rate limited/unavailable, retrying (attempt %d): %s",
+            state.attempt_number, state.outcome.exception()
+        ),
+        reraise=True
+    ):
+        with attempt:
+            return model.generate_content(parts, **overrides)
+
+
+def _clean_json(text: str) -> str:
+    """Strip markdown code fences Gemini sometimes wraps around JSON output"""
+    return text.strip().removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+
+
+def _parse_analysis(text: str) -> "Analysis":
+    """Decode and validate a Gemini analysis reply, rejecting ones that cannot become predictions"""
+    result = orjson.loads(_clean_json(text))
+    parsed = Analysis.model_validate(result)
+    if result.get("segments") and not parsed.segments:
+        raise ValueError("none of the returned segments are usable")
+    return parsed
+
+
+def analyze_audio_with_gemini(audio_path: str) -> "Analysis":
+    """Analyze audio file using Gemini, validated once and ready for formatting"""
+    result = _analyze_audio(audio_path)
+    # Fresh replies were validated while parsing; cache hits and fallbacks are plain dicts
+    return result if isinstance(result, Analysis) else Analysis.model_validate(result)
+
+
+def _analyze_audio(audio_path: str) -> Any:
     """Analyze audio file using Gemini with enhanced prompt and retry logic"""
     max_retries = 3
     retry_count = 0
     
+    # Identical audio analyzed with the same model and prompt is served from disk
+    cache_path = _analysis_cache_path(audio_path)
+    cached = _load_cached_analysis(cache_path)
+    if cached is not None:
+        logger.info("Analysis cache hit: %s", cache_path)
+        return cached
+    
+    model, prompt_cached = _get_analysis_model()
+    audio_file = None
+    
+    # Size the output limit to the audio; a truncated reply falls back to the full limit
+    token_budget = _output_token_budget(audio_path)
+    
     while retry_count < max_retries:
         try:
-            model = init_gemini()
-            
-            # Upload audio file
-            audio_file = genai.upload_file(audio_path, mime_type="audio/mpeg")
+            # Upload audio file once and reuse it across retries
+            if audio_file is None:
+                audio_file = _upload_audio(audio_path)
             
             # Generate analysis with enhanced prompt
-            response = model.generate_content([
-                ENHANCED_ANALYSIS_PROMPT,
-                audio_file
-            ])
+            if prompt_cached:
+                response = _generate(model, [audio_file], token_budget)
+            else:
+                response = _generate(model, [
+                    ENHANCED_ANALYSIS_PROMPT,
+                    audio_file
+                ], token_budget)
             
             # Check if response was blocked
             if not response.parts:
                 # Check finish reason
                 if response.candidates and response.candidates[0].finish_reason:
                     finish_reason = response.candidates[0].finish_reason
-                    print(f"Response blocked with finish_reason: {finish_reason}")
+                    logger.warning("Response blocked with finish_reason: %s", finish_reason)
                     
                     # If it's a safety block, retry with modified prompt
                     if finish_reason == 2:  # SAFETY
                         retry_count += 1
                         if retry_count < max_retries:
-                            print(f"Retrying with simpler prompt (attempt {retry_count}/{max_retries})...")
-                            # Try with a simpler prompt
-                            simple_prompt = """Analyze this audio and provide a JSON response with:
-- segments: array of speaker segments with start_time, end_time, speaker_id, text, language
-- summary_uzbek: brief summary in Uzbek
-- languages_detected: array of detected languages"""
-                            response = model.generate_content([simple_prompt, audio_file])
+                            logger.warning("Retrying with simpler prompt (attempt %s/%s)...", retry_count, max_retries)
+                            # Try with a simpler prompt; the cached model already carries
+                            # the full prompt, so use the plain one
+                            response = _generate(_get_model(), [SIMPLE_ANALYSIS_PROMPT, audio_file], token_budget)
                             if response.parts:
-                                text = response.text.strip()
-                                # Clean up response if needed
-                                if text.startswith("```json"):
-                                    text = text[7:]
-                                if text.endswith("```"):
-                                    text = text[:-3]
-                                result = json.loads(text)
-                                return result
+                                return _parse_analysis(response.text)
                             else:
                                 # Still blocked, return fallback
-                                print(f"Still blocked after retry {retry_count}")
+                                logger.warning("Still blocked after retry %s", retry_count)
                                 return get_fallback_response()
                         else:
                             # Max retries reached
                             return get_fallback_response()
                     else:
                         # Not a safety block, return fallback
-                        print(f"Response blocked with non-safety reason: {finish_reason}")
+                        logger.warning("Response blocked with non-safety reason: %s", finish_reason)
                         return get_fallback_response()
                 else:
                     # No candidates, return fallback
-                    print("No response candidates generated")
+                    logger.warning("No response candidates generated")
                     return get_fallback_response()
             
             # We have a valid response
-            text = response.text.strip()
-            # Clean up response if needed
-            if text.startswith("```json"):
-                text = text[7:]
-            if text.endswith("```"):
-                text = text[:-3]
-            
-            result = json.loads(text)
+            # Only cache replies that format cleanly; a bad one would stick for the TTL
+            result = _parse_analysis(response.text)
+            _store_cached_analysis(cache_path, result.model_dump())
             return result
             
-        except json.JSONDecodeError as e:
-            print(f"JSON parsing error (attempt {retry_count + 1}/{max_retries}): {str(e)}")
+        except ValueError as e:  # Malformed JSON or a reply that fails validation
+            logger.warning("Unusable Gemini reply (attempt %s/%s): %s", retry_count + 1, max_retries, e)
             retry_count += 1
+            token_budget = None  # The reply may have been cut off by the scaled limit
             if retry_count >= max_retries:
                 # Return a default structure on final failure
                 return {
@@ -495,8 +842,11 @@ def analyze_audio_with_gemini(audio_path: str) -> Dict[str, Any]:
             continue
             
         except Exception as e:
-            print(f"Gemini analysis error (attempt {retry_count + 1}/{max_retries}): {str(e)}")
+            logger.warning("Gemini analysis error (attempt %s/%s): %s", retry_count + 1, max_retries, e)
             retry_count += 1
+            if _is_retryable(e):
+                # _generate already spent its own retries on rate limits and outages
+                retry_count = max_retries
             if retry_count >= max_retries:
                 # Return a fallback response
                 return {
@@ -524,110 +874,141 @@ def analyze_audio_with_gemini(audio_path: str) -> Dict[str, Any]:
     raise HTTPException(status_code=500, detail="Failed to analyze audio after multiple attempts")
 
 
-def format_enhanced_predictions(analysis: Dict[str, Any], task_id: int) -> Dict[str, Any]:
+def _seconds(value: Any) -> Any:
+    """Accept "ss", "mm:ss" and "hh:mm:ss" timestamps alongside plain numbers"""
+    if isinstance(value, str) and ":" in value:
+        seconds = 0.0
+        for part in value.strip().split(":"):
+            seconds = seconds * 60 + float(part)
+        return seconds
+    return value
+
+
+class AnalysisSegment(BaseModel):
+    """One diarized segment of a Gemini analysis; odd values are coerced or dropped"""
+    # Extra fields (confidence, ...) are kept so cached analyses stay complete
+    model_config = ConfigDict(coerce_numbers_to_str=True, extra="allow")
+
+    speaker_id: str = "Speaker 1"
+    start_time: float = 0
+    end_time: float = 0
+    text: Optional[str] = None
+    language: Optional[str] = None
+    gender: Optional[str] = None
+    emotion: Optional[str] = None
+
+    @field_validator("speaker_id", mode="before")
+    @classmethod
+    def _speaker(cls, value: Any) -> Any:
+        if isinstance(value, list):
+            value = value[0] if value else None
+        return "Speaker 1" if value is None else value
+
+    @field_validator("start_time", "end_time", mode="before")
+    @classmethod
+    def _time(cls, value: Any) -> Any:
+        return 0 if value is None else _seconds(value)
+
+    @field_validator("text", mode="before")
+    @classmethod
+    def _text(cls, value: Any) -> Any:
+        if isinstance(value, list):
+            return " ".join(str(item) for item in value if item is not None)
+        return value if value is None or isinstance(value, (str, int, float)) else None
+
+    @field_validator("language", "gender", "emotion", mode="before")
+    @classmethod
+    def _choice(cls, value: Any) -> Any:
+        # Choices hold a single label; keep the first when Gemini lists several
+        if isinstance(value, list):
+            value = next((item for item in value if item), None)
+        return value if value is None or isinstance(value, (str, int, float)) else None
+
+
+class Analysis(BaseModel):
+    """The parts of a Gemini analysis that become Label Studio predictions"""
+    model_config = ConfigDict(extra="allow")
+
+    segments: Optional[List[AnalysisSegment]] = None
+    summary_uzbek: Optional[str] = None
+
+    @field_validator("segments", mode="before")
+    @classmethod
+    def _segments(cls, value: Any) -> Any:
+        # Validate segments one at a time so a single bad one doesn't sink the rest
+        if not isinstance(value, list):
+            return None
+        segments = []
+        for index, item in enumerate(value):
+            try:
+                segments.append(AnalysisSegment.model_validate(item))
+            except ValidationError as e:
+                logger.warning("Skipping unusable segment %s: %s", index, e.errors(include_url=False))
+        return segments
+
+    @field_validator("summary_uzbek", mode="before")
+    @classmethod
+    def _summary(cls, value: Any) -> Any:
+        if isinstance(value, list):
+            return " ".join(str(item) for item in value if item is not None)
+        return value if value is None or isinstance(value, (str, int, float)) else None
+
+
+# Fields shared by every region result on the audio track
+_REGION_BASE = {"to_name": "audio", "origin": "prediction"}
+
+# (from_name, result type, value key, segment attribute) for each per-segment result
+_SEGMENT_SPECS = (
+    ("speaker_labels", "labels", "labels", "speaker_id"),
+    ("language", "choices", "choices", "language"),
+    ("gender", "choices", "choices", "gender"),
+    ("emotion", "choices", "choices", "emotion"),
+    ("transcription", "textarea", "text", "text"),
+)
+
+
+def _region_prediction(segment_id: str, start: float, end: float, from_name: str,
+                       pred_type: str, value_key: str, value: Any) -> Dict[str, Any]:
+    """Build one Label Studio region result on the audio track"""
+    return {
+        **_REGION_BASE,
+        "id": segment_id,
+        "value": {"start": start, "end": end, value_key: [value], "channel": 0},
+        "from_name": from_name,
+        "type": pred_type,
+    }
+
+
+def format_enhanced_predictions(analysis: Analysis, task_id: int) -> Dict[str, Any]:
     """Convert enhanced Gemini analysis to Label Studio prediction format"""
     
     predictions = []
     
+    # Region IDs only need to be unique within this task's predictions
+    counter = itertools.count()
+    
     # Process each segment for speaker diarization with all attributes
-    if analysis.get("segments"):
-        for segment in analysis["segments"]:
-            # Generate unique ID for this segment
-            segment_id = str(uuid.uuid4())[:8]
-            
-            # Get segment details
-            start_time = segment.get("start_time", 0)
-            end_time = segment.get("end_time", 0)
-            
-            # 1. Speaker label (main region on audio)
-            predictions.append({
-                "id": segment_id,
-                "value": {
-                    "start": start_time,
-                    "end": end_time,
-                    "labels": [segment.get("speaker_id", "Speaker 1")],
-                    "channel": 0
-                },
-                "from_name": "speaker_labels",
-                "to_name": "audio",
-                "type": "labels",
-                "origin": "prediction"
-            })
-            
-            # 2. Language detection (same region ID)
-            if segment.get("language"):
-                predictions.append({
-                    "id": segment_id,
-                    "value": {
-                        "start": start_time,
-                        "end": end_time,
-                        "choices": [segment["language"]],
-                        "channel": 0
-                    },
-                    "from_name": "language",
-                    "to_name": "audio",
-                    "type": "choices",
-                    "origin": "prediction"
-                })
-            
-            # 3. Gender identification (same region ID)
-            if segment.get("gender"):
-                predictions.append({
-                    "id": segment_id,
-                    "value": {
-                        "start": start_time,
-                        "end": end_time,
-                        "choices": [segment["gender"]],
-                        "channel": 0
-                    },
-                    "from_name": "gender",
-                    "to_name": "audio",
-                    "type": "choices",
-                    "origin": "prediction"
-                })
-            
-            # 4. Emotion analysis (same region ID)
-            if segment.get("emotion"):
-                predictions.append({
-                    "id": segment_id,
-                    "value": {
-                        "start": start_time,
-                        "end": end_time,
-                        "choices": [segment["emotion"]],
-                        "channel": 0
-                    },
-                    "from_name": "emotion",
-                    "to_name": "audio",
-                    "type": "choices",
-                    "origin": "prediction"
-                })
-            
-            # 5. Transcription (same region ID)
-            if segment.get("text"):
-                predictions.append({
-                    "id": segment_id,
-                    "value": {
-                        "start": start_time,
-                        "end": end_time,
-                        "text": [segment["text"]],
-                        "channel": 0
-                    },
-                    "from_name": "transcription",
-                    "to_name": "audio",
-                    "type": "textarea",
-                    "origin": "prediction"
-                })
-    
-    # 6. Summary in Uzbek
-    if analysis.get("summary_uzbek"):
+    for segment in analysis.segments or ():
+        # Generate unique ID for this segment
+        segment_id = f"{task_id}-{next(counter):04x}"
+        
+        # Speaker label is the main region; language, gender, emotion and
+        # transcription share its ID and are skipped when empty
+        for from_name, pred_type, value_key, field in _SEGMENT_SPECS:
+            value = getattr(segment, field)
+            if value or from_name == "speaker_labels":
+                predictions.append(_region_prediction(segment_id, segment.start_time, segment.end_time,
+                                                      from_name, pred_type, value_key, value))
+    
+    # Summary in Uzbek
+    if analysis.summary_uzbek:
         predictions.append({
+            **_REGION_BASE,
             "value": {
-                "text": [analysis["summary_uzbek"]]
+                "text": [analysis.summary_uzbek]
             },
             "from_name": "summary",
-            "to_name": "audio",
             "type": "textarea",
-            "origin": "prediction"
         })
     
     return {
@@ -670,10 +1051,74 @@ async def setup(request: Dict[str, Any]):
     }
 
 
+async def _analyze_audio_url(audio_url: str, tmpdir: str) -> Analysis:
+    """Download and analyze one audio file"""
+    async with _task_semaphore:
+        # Download audio
+        audio_path = await download_audio(audio_url, tmpdir=tmpdir)
+        
+        # Analyze with enhanced Gemini prompt (blocking SDK call, run off the event loop)
+        return await asyncio.get_running_loop().run_in_executor(
+            _gemini_pool, analyze_audio_with_gemini, audio_path
+        )
+
+
+async def _process_task(task: Dict[str, Any],
+                        analyses: Dict[str, "asyncio.Future[Analysis]"],
+                        tmpdir: str) -> Optional[Dict[str, Any]]:
+    """Analyze and format a single Label Studio task
+    
+    `analyses` maps audio URLs to in-flight analyses for the current batch, so
+    tasks pointing at the same audio share one download and Gemini call.
+    Downloads go into the batch's `tmpdir`.
+    """
+    # Extract audio path
+    task_id = task.get("id", 1)
+    audio_url = task.get("data", {}).get("audio")
+    
+    if not audio_url:
+        logger.warning("No audio URL in task %s", task_id)
+        return None
+    
+    logger.info("Processing task %s: %s", task_id, audio_url)
+    
+    if audio_url not in analyses:
+        analyses[audio_url] = asyncio.ensure_future(_analyze_audio_url(audio_url, tmpdir))
+    analysis = await analyses[audio_url]
+    
+    # Format for Label Studio
+    prediction = format_enhanced_predictions(analysis, task_id)
+    
+    logger.info("Task %s processed successfully", task_id)
+    logger.debug("Found %s segments", len(analysis.segments or ()))
+    logger.debug("Languages: %s", getattr(analysis, "languages_detected", []))
+    
+    return prediction
+
+
+async def _process_task_safe(task: Dict[str, Any],
+                             analyses: Dict[str, "asyncio.Future[Analysis]"],
+                             tmpdir: str) -> Optional[Dict[str, Any]]:
+    """Run _process_task, turning failures into an empty prediction"""
+    try:
+        return await _process_task(task, analyses, tmpdir)
+    except Exception as e:
+        logger.error("Error processing task %s: %s", task.get('id'), e)
+        # Add empty prediction on error
+        return {
+            "result": [],
+            "score": 0.0,
+            "model_version": "gemini-1.5-flash-enhanced"
+        }
+
+
 @app.post("/predict")
-async def predict(request: Dict[str, Any]):
+async def predict(request: Dict[str, Any], stream: bool = False):
     """
     Generate enhanced predictions for Label Studio tasks
+    
+    With ?stream=1 predictions are sent as newline-delimited JSON in completion
+    order, each tagged with its "task" id, instead of one aggregated response.
     """
     
     # Validate request
@@ -684,51 +1129,39 @@ async def predict(request: Dict[str, Any]):
     if not tasks:
         raise HTTPException(status_code=422, detail="At least one task required")
     
-    results = []
+    # One shared analysis per distinct audio URL in this batch
+    analyses: Dict[str, "asyncio.Future[Analysis]"] = {}
     
-    for task in tasks:
-        try:
-            # Extract audio path
-            task_id = task.get("id", 1)
-            audio_url = task.get("data", {}).get("audio")
-            
-            if not audio_url:
-                print(f"No audio URL in task {task_id}")
-                continue
-            
-            print(f"Processing task {task_id}: {audio_url}")
-            
-            # Download audio
-            audio_path = await download_audio(audio_url)
-            
+    if stream:
+        # The batch directory must outlive this handler, so the generator removes it
+        batch_dir = tempfile.TemporaryDirectory(prefix="lsgemini-", dir=TEMP_DIR)
+        
+        async def _tagged(task):
+            return task.get("id", 1), await _process_task_safe(task, analyses, batch_dir.name)
+        
+        async def _ndjson():
+            pending = [asyncio.ensure_future(_tagged(task)) for task in tasks]
             try:
-                # Analyze with enhanced Gemini prompt
-                analysis = analyze_audio_with_gemini(audio_path)
-                
-                # Format for Label Studio
-                prediction = format_enhanced_predictions(analysis, task_id)
-                results.append(prediction)
-                
-                print(f"Task {task_id} processed successfully")
-                print(f"Found {len(analysis.get('segments', []))} segments")
-                print(f"Languages: {analysis.get('languages_detected', [])}")
-                
+                for next_done in asyncio.as_completed(pending):
+                    task_id, prediction = await next_done
+                    if prediction is not None:
+                        yield orjson.dumps({"task": task_id, **prediction}) + b"\n"
             finally:
-                # Clean up temp file
-                if os.path.exists(audio_path) and audio_path.startswith("/tmp"):
-                    os.unlink(audio_path)
-            
-        except Exception as e:
-            print(f"Error processing task {task.get('id')}: {str(e)}")
-            # Add empty prediction on error
-            results.append({
-                "result": [],
-                "score": 0.0,
-                "model_version": "gemini-1.5-flash-enhanced"
-            })
+                # A client that disconnects mid-stream leaves tasks running; stop them
+                # before their downloads land in a removed directory
+                for pending_task in pending:
+                    pending_task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                batch_dir.cleanup()
+        
+        return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+    
+    # Every download of the batch lands here and is removed with the directory
+    with tempfile.TemporaryDirectory(prefix="lsgemini-", dir=TEMP_DIR) as tmpdir:
+        results = await asyncio.gather(*[_process_task_safe(task, analyses, tmpdir) for task in tasks])
     
     # Return in Label Studio format
-    return {"results": results}
+    return {"results": [prediction for prediction in results if prediction is not None]}
 
 
 @app.post("/train")
@@ -754,86 +1187,160 @@ class SegmentTranscribeResponse(BaseModel):
     confidence: float
 
 
-SEGMENT_TRANSCRIBE_PROMPT = """
-Analyze this audio segment and provide a detailed transcription.
-
-REQUIREMENTS:
-1. Transcribe EXACTLY what is said, word for word
-2. Use the CORRECT script for the language:
-   - Uzbek: Latin script with apostrophes (o', g', ng) - e.g., "O'zbekiston", "yaxshi"
-   - Russian: Cyrillic script - e.g., "привет", "хорошо"
-   - English: Latin script
-   - Arabic: Arabic script
-   - Turkish: Latin with Turkish characters (ğ, ş, ı, ö, ü, ç)
-3. Include hesitations (um, uh, er) and repetitions
-4. Detect the primary language
-5. Identify speaker gender (Male/Female/Unknown)
-6. Detect emotion (Neutral/Happy/Sad/Angry/Surprised/Fearful/Excited/Calm/Frustrated)
-
-Return ONLY valid JSON in this format:
-{
-    "transcription": "Exact transcription text in appropriate script",
-    "language": "Uzbek",
-    "gender": "Male",
-    "emotion": "Neutral",
-    "confidence": 0.95
-}
-"""
+SEGMENT_TRANSCRIBE_PROMPT = (PROMPTS_DIR / "segment_transcribe.txt").read_text(encoding="utf-8")
 
+# Template for several clips in one request; filled with str.format(count=, gap=, clips=)
+SEGMENT_BATCH_TRANSCRIBE_PROMPT = (PROMPTS_DIR / "segment_batch_transcribe.txt").read_text(encoding="utf-8")
 
-async def extract_audio_segment(audio_path: str, start_time: float, end_time: float) -> str:
-    """Extract a segment from audio file using ffmpeg"""
-    import subprocess
+# Silence inserted between clips when batching segment transcriptions
+SEGMENT_BATCH_GAP_SECONDS = 1.0
 
-    # Create temp file for segment
-    segment_path = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3").name
 
-    duration = end_time - start_time
+# Segment cuts decode audio in worker threads; keep at most one per CPU core
+_segment_semaphore = asyncio.Semaphore(os.cpu_count() or 1)
 
-    # Use ffmpeg to extract segment
-    cmd = [
-        "ffmpeg", "-y",
-        "-i", audio_path,
-        "-ss", str(start_time),
-        "-t", str(duration),
-        "-acodec", "libmp3lame",
-        "-ar", "16000",
-        "-ac", "1",
-        segment_path
-    ]
+# Input codecs whose packets can be cut without re-encoding
+_STREAM_COPY_CODECS = {"mp3", "mp3float"}
 
-    try:
-        process = subprocess.run(
-            cmd,
-            capture_output=True,
-            timeout=30
-        )
-        if process.returncode != 0:
-            print(f"FFmpeg error: {process.stderr.decode()}")
-            raise Exception(f"FFmpeg failed: {process.stderr.decode()}")
 
-        return segment_path
-    except subprocess.TimeoutExpired:
-        raise Exception("FFmpeg timeout")
-    except Exception as e:
-        if os.path.exists(segment_path):
+def _copy_segment(container, stream, segment_path: str, start_time: float, end_time: float):
+    """Cut [start_time, end_time) by copying compressed packets (no decode/encode)
+    
+    Cuts land on frame boundaries (~26 ms for MP3), which Gemini tolerates.
+    """
+    with av.open(segment_path, "w", format="mp3") as output:
+        out_stream = output.add_stream_from_template(stream)
+
+        container.seek(int(start_time / stream.time_base), stream=stream)
+
+        first_pts = None
+        for packet in container.demux(stream):
+            if packet.pts is None:
+                continue
+            packet_time = float(packet.pts * stream.time_base)
+            if packet_time >= end_time:
+                break
+            if packet_time + float(packet.duration * stream.time_base) <= start_time:
+                continue
+            # Rebase timestamps so the clip starts at zero
+            if first_pts is None:
+                first_pts = packet.pts
+            packet.pts -= first_pts
+            packet.dts -= first_pts
+            packet.stream = out_stream
+            output.mux(packet)
+
+
+def _decode_segment(container, stream, segment_path: str, start_time: float, end_time: float):
+    """Decode [start_time, end_time) into a 16 kHz mono WAV file"""
+    with av.open(segment_path, "w", format="wav") as output:
+        out_stream = output.add_stream("pcm_s16le", rate=16000, layout="mono")
+        resampler = av.AudioResampler(format="s16", layout="mono", rate=16000)
+
+        # Seek close to the start instead of decoding everything before it
+        container.seek(int(start_time / stream.time_base), stream=stream)
+
+        for frame in container.decode(stream):
+            if frame.time is None:
+                continue
+            if frame.time >= end_time:
+                break
+            if frame.time + frame.samples / frame.sample_rate <= start_time:
+                continue
+            for resampled in resampler.resample(frame):
+                for packet in out_stream.encode(resampled):
+                    output.mux(packet)
+
+        # Flush resampler and encoder
+        for resampled in resampler.resample(None):
+            for packet in out_stream.encode(resampled):
+                output.mux(packet)
+        for packet in out_stream.encode(None):
+            output.mux(packet)
+
+
+def _cut_segment(audio_path: str, start_time: float, end_time: float,
+                 tmpdir: Optional[str], pcm: bool) -> str:
+    """Write [start_time, end_time) of audio_path to a new temp file and return its path
+    
+    MP3 input is stream-copied unless `pcm` is set; everything else is decoded
+    to 16 kHz mono WAV.
+    """
+    with av.open(audio_path) as container:
+        stream = container.streams.audio[0]
+        stream_copy = not pcm and stream.codec_context.name in _STREAM_COPY_CODECS
+
+        # Create temp file for segment
+        suffix = ".mp3" if stream_copy else ".wav"
+        fd, segment_path = tempfile.mkstemp(dir=tmpdir or TEMP_DIR, suffix=suffix)
+        os.close(fd)  # PyAV reopens the path itself
+
+        try:
+            if stream_copy:
+                _copy_segment(container, stream, segment_path, start_time, end_time)
+            else:
+                _decode_segment(container, stream, segment_path, start_time, end_time)
+        except Exception:
             os.unlink(segment_path)
-        raise e
+            raise
+
+    return segment_path
+
+
+async def extract_audio_segment(audio_path: str, start_time: float, end_time: float,
+                                tmpdir: Optional[str] = None, pcm: bool = False) -> str:
+    """Extract a segment from audio file in-process with PyAV (pcm=True forces WAV output)"""
+    try:
+        async with _segment_semaphore:
+            return await asyncio.to_thread(_cut_segment, audio_path, start_time, end_time, tmpdir, pcm)
+    except Exception as e:
+        logger.error("Segment extraction error: %s", e)
+        raise Exception(f"Segment extraction failed: {e}")
+
+
+def _concat_segments(segment_paths: List[str], output_path: str,
+                     gap_seconds: float = SEGMENT_BATCH_GAP_SECONDS) -> List[tuple]:
+    """Join extracted WAV clips with silence between them
+    
+    Returns the (start, end) position of every clip in the joined file.
+    """
+    positions = []
+    offset = 0.0
+    with wave.open(output_path, "wb") as output:
+        for i, segment_path in enumerate(segment_paths):
+            with wave.open(segment_path, "rb") as clip:
+                if i == 0:
+                    output.setparams(clip.getparams())
+                    silence = b"\x00" * (
+                        int(clip.getframerate() * gap_seconds) * clip.getsampwidth() * clip.getnchannels()
+                    )
+                frames = clip.readframes(clip.getnframes())
+                duration = clip.getnframes() / clip.getframerate()
+            output.writeframes(frames)
+            output.writeframes(silence)
+            positions.append((offset, offset + duration))
+            offset += duration + gap_seconds
+    return positions
+
+
+def _audio_mime_type(audio_path: str) -> str:
+    """Mime type to declare when uploading audio to Gemini"""
+    return "audio/wav" if audio_path.endswith(".wav") else "audio/mpeg"
 
 
 def transcribe_segment_with_gemini(audio_path: str) -> Dict[str, Any]:
     """Transcribe a single audio segment using Gemini"""
     try:
-        model = init_gemini()
+        model = _get_model()
 
         # Upload audio file
-        audio_file = genai.upload_file(audio_path, mime_type="audio/mpeg")
+        audio_file = _upload_audio(audio_path)
 
         # Generate transcription
-        response = model.generate_content([
+        response = _generate(model, [
             SEGMENT_TRANSCRIBE_PROMPT,
             audio_file
-        ])
+        ], _output_token_budget(audio_path))
 
         if not response.parts:
             return {
@@ -844,17 +1351,11 @@ def transcribe_segment_with_gemini(audio_path: str) -> Dict[str, Any]:
                 "confidence": 0.0
             }
 
-        text = response.text.strip()
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-
-        result = json.loads(text)
+        result = orjson.loads(_clean_json(response.text))
         return result
 
     except json.JSONDecodeError as e:
-        print(f"JSON parsing error in segment transcription: {e}")
+        logger.warning("JSON parsing error in segment transcription: %s", e)
         return {
             "transcription": "[Transcription error]",
             "language": "Unknown",
@@ -863,7 +1364,7 @@ def transcribe_segment_with_gemini(audio_path: str) -> Dict[str, Any]:
             "confidence": 0.0
         }
     except Exception as e:
-        print(f"Segment transcription error: {e}")
+        logger.error("Segment transcription error: %s", e)
         return {
             "transcription": f"[Error: {str(e)}]",
             "language": "Unknown",
@@ -873,63 +1374,171 @@ def transcribe_segment_with_gemini(audio_path: str) -> Dict[str, Any]:
         }
 
 
+def _untranscribed(reason: str) -> Dict[str, Any]:
+    """Placeholder result for a segment Gemini did not transcribe"""
+    return {
+        "transcription": reason,
+        "language": "Unknown",
+        "gender": "Unknown",
+        "emotion": "Neutral",
+        "confidence": 0.0
+    }
+
+
+def _segment_response(result: Dict[str, Any]) -> SegmentTranscribeResponse:
+    """Response for one Gemini segment result; missing or null fields get defaults"""
+    defaults = _untranscribed("")
+    return SegmentTranscribeResponse(**{
+        key: default if result.get(key) is None else result[key]
+        for key, default in defaults.items()
+    })
+
+
+def _clip_index(item: Dict[str, Any]) -> Optional[int]:
+    """1-based clip number of a batch result (Gemini sometimes sends it as a string)"""
+    try:
+        return int(item.get("index"))
+    except (TypeError, ValueError):
+        return None
+
+
+def transcribe_segments_batch_with_gemini(audio_path: str, positions: List[tuple]) -> List[Dict[str, Any]]:
+    """Transcribe several clips joined into one audio file with a single Gemini call"""
+    try:
+        model = _get_model()
+
+        # One upload covers every clip
+        audio_file = _upload_audio(audio_path)
+
+        prompt = SEGMENT_BATCH_TRANSCRIBE_PROMPT.format(
+            count=len(positions),
+            gap=SEGMENT_BATCH_GAP_SECONDS,
+            clips="\n".join(
+                f"- Clip {i}: {start:.2f} - {end:.2f}" for i, (start, end) in enumerate(positions, 1)
+            )
+        )
+        response = _generate(model, [prompt, audio_file], _output_token_budget(audio_path))
+
+        if not response.parts:
+            return [_untranscribed("[Could not transcribe]") for _ in positions]
+
+        by_index = {
+            _clip_index(item): item
+            for item in orjson.loads(_clean_json(response.text)).get("segments", [])
+            if isinstance(item, dict)
+        }
+        return [by_index.get(i, _untranscribed("[Could not transcribe]")) for i in range(1, len(positions) + 1)]
+
+    except json.JSONDecodeError as e:
+        logger.warning("JSON parsing error in batch segment transcription: %s", e)
+        return [_untranscribed("[Transcription error]") for _ in positions]
+    except Exception as e:
+        logger.error("Batch segment transcription error: %s", e)
+        return [_untranscribed(f"[Error: {str(e)}]") for _ in positions]
+
+
 @app.post("/transcribe-segment", response_model=SegmentTranscribeResponse)
 async def transcribe_segment(request: SegmentTranscribeRequest):
     """
     Transcribe a specific audio segment using Gemini.
     Used for on-demand transcription when user selects a region.
     """
-    print(f"Transcribe segment request: {request.audio_url} [{request.start_time:.2f} - {request.end_time:.2f}]")
+    logger.info("Transcribe segment request: %s [%.2f - %.2f]", request.audio_url, request.start_time, request.end_time)
 
-    audio_path = None
-    segment_path = None
+    # Downloaded audio and the extracted clip are removed with the directory
+    with tempfile.TemporaryDirectory(prefix="lsgemini-", dir=TEMP_DIR) as tmpdir:
+        try:
+            # Download the full audio
+            audio_path = await download_audio(request.audio_url, tmpdir=tmpdir)
+
+            # Extract the segment
+            segment_path = await extract_audio_segment(
+                audio_path,
+                request.start_time,
+                request.end_time,
+                tmpdir=tmpdir
+            )
 
-    try:
-        # Download the full audio
-        audio_path = await download_audio(request.audio_url)
-
-        # Extract the segment
-        segment_path = await extract_audio_segment(
-            audio_path,
-            request.start_time,
-            request.end_time
-        )
+            # Transcribe with Gemini
+            result = await asyncio.get_running_loop().run_in_executor(
+                _gemini_pool, transcribe_segment_with_gemini, segment_path
+            )
 
-        # Transcribe with Gemini
-        result = transcribe_segment_with_gemini(segment_path)
+            logger.debug("Transcription result: %.100s...", result.get('transcription', ''))
 
-        print(f"Transcription result: {result.get('transcription', '')[:100]}...")
+            return _segment_response(result)
 
-        return SegmentTranscribeResponse(
-            transcription=result.get("transcription", ""),
-            language=result.get("language", "Unknown"),
-            gender=result.get("gender", "Unknown"),
-            emotion=result.get("emotion", "Neutral"),
-            confidence=result.get("confidence", 0.0)
-        )
+        except Exception as e:
+            logger.error("Error in transcribe_segment: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
 
-    except Exception as e:
-        print(f"Error in transcribe_segment: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
 
-    finally:
-        # Cleanup temp files
-        if audio_path and os.path.exists(audio_path) and audio_path.startswith("/tmp"):
-            os.unlink(audio_path)
-        if segment_path and os.path.exists(segment_path):
-            os.unlink(segment_path)
+@app.post("/transcribe-segments", response_model=List[SegmentTranscribeResponse])
+async def transcribe_segments(requests: List[SegmentTranscribeRequest]):
+    """
+    Transcribe several audio segments with one Gemini request.
+    Clips are extracted in parallel, joined with short silences and uploaded once;
+    results are returned in request order.
+    """
+    if not requests:
+        raise HTTPException(status_code=422, detail="At least one segment required")
+
+    logger.info("Transcribe %s segments in one batch", len(requests))
+
+    with tempfile.TemporaryDirectory(prefix="lsgemini-", dir=TEMP_DIR) as tmpdir:
+        try:
+            # Download each distinct audio once
+            urls = list(dict.fromkeys(request.audio_url for request in requests))
+            audio_paths = dict(zip(urls, await asyncio.gather(
+                *[download_audio(url, tmpdir=tmpdir) for url in urls]
+            )))
+
+            # Extract all segments in parallel
+            segment_paths = await asyncio.gather(*[
+                extract_audio_segment(
+                    audio_paths[request.audio_url],
+                    request.start_time,
+                    request.end_time,
+                    tmpdir=tmpdir,
+                    pcm=True  # Clips are joined as raw PCM
+                )
+                for request in requests
+            ])
+
+            batch_path = os.path.join(tmpdir, "segments.wav")
+            positions = await asyncio.to_thread(_concat_segments, segment_paths, batch_path)
+
+            # Transcribe with Gemini
+            results = await asyncio.get_running_loop().run_in_executor(
+                _gemini_pool, transcribe_segments_batch_with_gemini, batch_path, positions
+            )
+
+            return [_segment_response(result) for result in results]
+
+        except Exception as e:
+            logger.error("Error in transcribe_segments: %s", e)
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 if __name__ == "__main__":
     # Check for API key
     if not GEMINI_API_KEY:
-        print("ERROR: GEMINI_API_KEY environment variable is required")
-        print("Set it with: export GEMINI_API_KEY=your_api_key_here")
+        logger.error("GEMINI_API_KEY environment variable is required")
+        logger.error("Set it with: export GEMINI_API_KEY=your_api_key_here")
         exit(1)
     
-    print(f"Starting Enhanced Label Studio ML Backend on {HOST}:{PORT}")
-    print(f"Gemini Model: {GEMINI_MODEL}")
-    print(f"Gemini API Key: {GEMINI_API_KEY[:20]}...")
-    print(f"Features: Speaker diarization, Language-specific transcription, Per-segment analysis")
+    logger.info("Starting Enhanced Label Studio ML Backend on %s:%s", HOST, PORT)
+    logger.info("Gemini Model: %s", GEMINI_MODEL)
+    logger.info("Gemini API Key: %s...", GEMINI_API_KEY[:20])
+    logger.info("Features: Speaker diarization, Language-specific transcription, Per-segment analysis")
+    logger.info("Workers: %s", WORKERS)
     
-    uvicorn.run(app, host=HOST, port=PORT)
\ No newline at end of file
+    # Multiple workers need an import string; uvloop/httptools come with uvicorn[standard]
+    uvicorn.run(
+        "enhanced_api:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        loop="uvloop",
+        http="httptools"
+    )
\ No newline at end of file
@@ -0,0 +1,25 @@
+"""
+Gunicorn settings for production deployments
+
+Usage: gunicorn -c src/gunicorn_conf.py
+Pick the app with APP_MODULE (default: enhanced_api:app, or simple_api:app).
+"""
+
+import os
+
+
+# Import the app modules from src/ regardless of the launch directory
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = os.getenv("APP_MODULE", "enhanced_api:app")
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '9090')}"
+workers = int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Gemini analyses of long audio can take a while
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+loglevel = os.getenv("LOG_LEVEL", "info").lower()
+accesslog = "-"
@@ -4,18 +4,46 @@ Simplified Label Studio ML Backend for Audio Analysis using Gemini API
 """
 
 import os
+import re
+import sys
 import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+import base64
+import hashlib
 import asyncio
 import tempfile
-from typing import Dict, List, Any
+import threading
+import urllib.parse
+import urllib.request
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
 from pathlib import Path
 
+import aiofiles
+import aiofiles.tempfile
+import orjson
 import uvicorn
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import httpx
 import google.generativeai as genai
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+
+# SIMD content hashing for the analysis cache key; blake2b from the stdlib otherwise
+try:
+    from blake3 import blake3 as _fast_hasher
+except ImportError:
+    try:
+        from xxhash import xxh3_128 as _fast_hasher
+    except ImportError:
+        _fast_hasher = None
 
 
 # Configuration
@@ -25,14 +53,63 @@ LABEL_STUDIO_API_KEY = os.getenv("LABEL_STUDIO_API_KEY", "")
 PORT = int(os.getenv("PORT", "9090"))
 HOST = os.getenv("HOST", "0.0.0.0")
 
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "8"))  # Parallel tasks per /predict batch
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # DEBUG also logs auth details
+
+# Handlers only enqueue records; a listener thread does the actual stream writes
+# so request handlers never block on stdout
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger("simple_api")
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+
+# Analysis results cache keyed by audio content; set to an empty string to disable
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR", os.path.expanduser("~/.cache/ls-gemini"))
+ANALYSIS_CACHE_MAX_FILES = int(os.getenv("ANALYSIS_CACHE_MAX_FILES", "10000"))  # Least recently used beyond this are removed
+
+# Read size for streamed downloads
+DOWNLOAD_CHUNK_SIZE = 1 << 18
+# Read size for public (non-Label Studio) downloads fetched with urllib
+PUBLIC_DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Share one pooled HTTP client for Label Studio token refreshes and downloads"""
+    # Build the Gemini model up front so a missing API key fails at startup
+    init_gemini()
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32),
+        # Audio is already compressed; gzip would only add work on both ends
+        headers={"User-Agent": "ls-ml/1.0", "Accept-Encoding": "identity"}
+    )
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+
 
 # Initialize FastAPI
 app = FastAPI(
     title="Label Studio Audio ML Backend",
     description="Audio analysis predictions using Gemini AI",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Bounds concurrent Gemini work so large batches don't exhaust API quota
+_task_semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
 # Add CORS
 app.add_middleware(
     CORSMiddleware,
@@ -44,8 +121,9 @@ app.add_middleware(
 
 
 # Initialize Gemini
+@lru_cache(maxsize=1)
 def init_gemini():
-    """Initialize Gemini AI model"""
+    """Initialize Gemini AI model (built once per process and reused)"""
     if not GEMINI_API_KEY:
         raise ValueError("GEMINI_API_KEY environment variable is required")
     
@@ -88,6 +166,26 @@ Analyze this audio file and provide a comprehensive analysis in JSON format:
 
 Provide ONLY valid JSON in your response, no additional text.
 """
+ANALYSIS_PROMPT = sys.intern(ANALYSIS_PROMPT)
+PROMPT_HASH = hashlib.sha256(ANALYSIS_PROMPT.encode("utf-8")).hexdigest()[:12]
+
+# The prompt as a ready-made request part, so the SDK doesn't convert the string on every call
+ANALYSIS_PROMPT_PART = genai.protos.Part(text=ANALYSIS_PROMPT)
+
+
+# Access token obtained from the refresh token, reused until shortly before it expires
+_token_cache = {"access": None, "expires_at": 0.0}
+_token_lock = asyncio.Lock()
+
+
+def _jwt_expiry(token: str) -> float:
+    """Read the `exp` claim from a JWT without verifying it (0.0 if unavailable)"""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload)).get("exp", 0))
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return 0.0
 
 
 async def get_access_token():
@@ -99,9 +197,12 @@ async def get_access_token():
     
     # If it's a JWT refresh token, try to get an access token
     if LABEL_STUDIO_API_KEY.startswith("eyJ"):
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
+        async with _token_lock:
+            if _token_cache["access"] and time.time() < _token_cache["expires_at"] - 30:
+                return _token_cache["access"]
+            
+            try:
+                response = await app.state.http.post(
                     f"{LABEL_STUDIO_URL}/api/token/refresh/",
                     json={"refresh": LABEL_STUDIO_API_KEY},
                     timeout=10.0
@@ -110,185 +211,427 @@ async def get_access_token():
                     data = response.json()
                     access_token = data.get("access")
                     if access_token:
-                        print(f"Got access token from refresh token")
+                        logger.debug("Got access token from refresh token")
+                        _token_cache["access"] = access_token
+                        _token_cache["expires_at"] = _jwt_expiry(access_token)
                         return access_token
-        except Exception as e:
-            print(f"Could not refresh token: {e}")
+            except Exception as e:
+                logger.warning("Could not refresh token: %s", e)
     
     # Return original token if refresh fails or it's not a JWT
     return LABEL_STUDIO_API_KEY
 
 
-async def download_audio(url: str) -> str:
-    """Download audio file from URL or handle local file"""
+class UrlKind(IntEnum):
+    """Where a task's audio reference points"""
+    LOCAL_ABS = 0    # /data/upload/... - mounted locally or served by Label Studio
+    FILE_URI = 1     # file:///path/on/this/host
+    LS_RELATIVE = 2  # bare path under Label Studio's /data/
+    LS_HTTP = 3      # absolute URL to Label Studio media, under any host name (needs auth)
+    REMOTE_HTTP = 4  # any other http(s) URL (public media)
+
+
+_LS_NETLOC = urllib.parse.urlsplit(LABEL_STUDIO_URL).netloc
+
+# Label Studio media paths; tasks often name the host differently from LABEL_STUDIO_URL
+# (e.g. localhost:8080 vs label-studio:8080 inside Docker)
+_LS_MEDIA_PREFIXES = ("/data/upload/", "/data/local-files/")
+_HOST_RE = re.compile(r"^https?://[^/]+")
+
+
+def _classify_url(url: str) -> UrlKind:
+    """Decide once how an audio reference is fetched"""
+    head = url[:8]
+    if head.startswith("/"):
+        return UrlKind.LOCAL_ABS
+    if head.startswith("file://"):
+        return UrlKind.FILE_URI
+    if head.startswith(("http://", "https://")):
+        parts = urllib.parse.urlsplit(url)
+        if parts.netloc == _LS_NETLOC or parts.path.startswith(_LS_MEDIA_PREFIXES):
+            return UrlKind.LS_HTTP
+        return UrlKind.REMOTE_HTTP
+    return UrlKind.LS_RELATIVE
+
+
+# Label Studio media path -> local file found for it; only hits are remembered
+_local_paths: Dict[str, str] = {}
+_local_paths_lock = threading.Lock()
+_LOCAL_PATHS_MAX = 4096
+
+
+def _resolve_local(url: str) -> Optional[str]:
+    """Local file behind a Label Studio path or file:// URL, if there is one
+    
+    Found paths are remembered and re-checked on reuse, so a deleted file falls
+    back to downloading and a file that appears later is still picked up.
+    """
+    local_path = _local_paths.get(url)
+    if local_path is not None:
+        if os.path.isfile(local_path):
+            return local_path
+        with _local_paths_lock:
+            _local_paths.pop(url, None)
+    
+    local_path = _find_local(url)
+    if local_path is not None:
+        with _local_paths_lock:
+            if len(_local_paths) >= _LOCAL_PATHS_MAX:
+                del _local_paths[next(iter(_local_paths))]
+            _local_paths[url] = local_path
+    return local_path
+
+
+def _find_local(url: str) -> Optional[str]:
+    """Look on disk for the file behind a Label Studio path or file:// URL"""
+    # Check if it's a local file reference
+    if url.startswith("/"):
+        # Try to find local file
+        local_path = f"/mnt/mata/labelStudio{url}"
+        if os.path.isfile(local_path):
+            return local_path
+        # Also check without the leading slash
+        local_path = f"/mnt/mata/labelStudio/{url.lstrip('/')}"
+        if os.path.isfile(local_path):
+            return local_path
+    
+    # Check if it's file:// URL
+    if url.startswith("file://"):
+        local_path = url[7:]  # Remove 'file://' prefix
+        if os.path.isfile(local_path):
+            return local_path
+    
+    return None
+
+
+def _new_hasher():
+    """Hasher for the audio content key of the analysis cache"""
+    if _fast_hasher is not None:
+        return _fast_hasher()
+    return hashlib.blake2b(digest_size=16)
+
+
+def _content_key(hasher) -> str:
+    """128-bit hex key from a finished hasher (blake3 digests are truncated)"""
+    return hasher.hexdigest()[:32]
+
+
+def _file_digest(path: str) -> str:
+    """Content key of a file already on disk (runs in a worker thread)"""
+    with open(path, "rb") as f:
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return _content_key(hashlib.file_digest(f, _new_hasher))
+        hasher = _new_hasher()
+        while chunk := f.read(PUBLIC_DOWNLOAD_CHUNK_SIZE):
+            hasher.update(chunk)
+        return _content_key(hasher)
+
+
+def _urllib_download(url: str) -> Tuple[str, Optional[str]]:
+    """Blocking download of a public URL into a new temp file (runs in a worker thread)
+    
+    Returns (path, content digest); the digest is computed while copying, and only
+    when the analysis cache is enabled.
+    """
+    request = urllib.request.Request(url, headers={"User-Agent": "ls-ml/1.0"})
+    hasher = _new_hasher() if ANALYSIS_CACHE_DIR else None
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as f:
+        try:
+            with urllib.request.urlopen(request, timeout=30.0) as response:
+                while chunk := response.read(PUBLIC_DOWNLOAD_CHUNK_SIZE):
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+    return f.name, _content_key(hasher) if hasher is not None else None
+
+
+async def download_audio(url: str) -> Tuple[str, bool, Optional[str]]:
+    """Download audio file from URL or handle local file
+    
+    Returns (path, is_temp, content digest); only temp downloads may be deleted
+    by the caller, local files are served in place. The digest is None when the
+    analysis cache is disabled, since nothing would use it.
+    """
+    temp_path = None
     try:
-        # Check if it's a local file reference
-        if url.startswith("/") and not url.startswith(("http://", "https://")):
-            # Try to find local file
-            local_path = f"/mnt/mata/labelStudio{url}"
-            if os.path.exists(local_path):
-                return local_path
-            # Also check without the leading slash
-            local_path = f"/mnt/mata/labelStudio/{url.lstrip('/')}"
-            if os.path.exists(local_path):
-                return local_path
+        kind = _classify_url(url)
         
-        # Check if it's file:// URL
-        if url.startswith("file://"):
-            local_path = url[7:]  # Remove 'file://' prefix
-            if os.path.exists(local_path):
-                return local_path
+        if kind <= UrlKind.FILE_URI:
+            # Serve local files in place (stat calls and hashing run off the event loop)
+            local_path = await asyncio.to_thread(_resolve_local, url)
+            if local_path:
+                if not ANALYSIS_CACHE_DIR:
+                    return local_path, False, None
+                try:
+                    return local_path, False, await asyncio.to_thread(_file_digest, local_path)
+                except FileNotFoundError:
+                    # Removed since it was found; Label Studio may still serve it
+                    if kind == UrlKind.FILE_URI:
+                        raise
+            if kind == UrlKind.FILE_URI:
+                raise FileNotFoundError(url[7:])
         
-        # Create temporary file for download
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp3")
-        temp_path = temp_file.name
-        temp_file.close()
+        # Public media (anything not served by Label Studio) needs no auth; urllib
+        # streams large CDN files much faster than httpx
+        if kind == UrlKind.REMOTE_HTTP:
+            temp_path, digest = await asyncio.to_thread(_urllib_download, url)
+            return temp_path, True, digest
         
         # Construct full URL if needed
-        if not url.startswith(("http://", "https://")):
-            if url.startswith("/"):
-                url = f"{LABEL_STUDIO_URL}{url}"
+        if kind == UrlKind.LOCAL_ABS:
+            url = f"{LABEL_STUDIO_URL}{url}"
+        elif kind == UrlKind.LS_RELATIVE:
+            url = f"{LABEL_STUDIO_URL}/data/{url}"
+        elif urllib.parse.urlsplit(url).netloc != _LS_NETLOC:
+            # Label Studio media under another host name; fetch it through LABEL_STUDIO_URL
+            url = f"{LABEL_STUDIO_URL}{_HOST_RE.sub('', url)}"
+        
+        # Download file over the shared connection pool
+        headers = {}
+        
+        # Get access token (handles refresh if needed)
+        token = await get_access_token()
+        if token:
+            # Use Bearer for JWT tokens, Token for legacy tokens
+            if token.startswith("eyJ"):
+                headers["Authorization"] = f"Bearer {token}"
+                logger.debug("Using Bearer auth with token: %.20s...", token)
             else:
-                url = f"{LABEL_STUDIO_URL}/data/{url}"
+                headers["Authorization"] = f"Token {token}"
+                logger.debug("Using Token auth with token: %.20s...", token)
         
-        # Download file
-        async with httpx.AsyncClient() as client:
-            headers = {}
-            
-            # Get access token (handles refresh if needed)
-            token = await get_access_token()
-            if token:
-                # Use Bearer for JWT tokens, Token for legacy tokens
-                if token.startswith("eyJ"):
-                    headers["Authorization"] = f"Bearer {token}"
-                    print(f"Using Bearer auth with token: {token[:20]}...")
-                else:
-                    headers["Authorization"] = f"Token {token}"
-                    print(f"Using Token auth with token: {token[:20]}...")
-            
-            response = await client.get(url, headers=headers, timeout=30.0)
-            response.raise_for_status()
+        # Create temporary file for download and write straight into its open handle;
+        # aiofiles runs the writes in a thread so the event loop keeps serving
+        async with aiofiles.tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as f:
+            temp_path = f.name
             
-            # Save to temp file
-            with open(temp_path, "wb") as f:
-                f.write(response.content)
+            # Stream to disk so large files never sit fully in memory, hashing as we go
+            hasher = _new_hasher() if ANALYSIS_CACHE_DIR else None
+            async with app.state.http.stream("GET", url, headers=headers) as response:
+                response.raise_for_status()
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    await f.write(chunk)
         
-        return temp_path
+        return temp_path, True, _content_key(hasher) if hasher is not None else None
         
     except Exception as e:
-        print(f"Error downloading audio: {str(e)}")
+        # The task boundary logs the traceback; one line here is enough
+        logger.warning("Error downloading audio: %s", e)
+        if temp_path:
+            os.unlink(temp_path)
         raise HTTPException(status_code=500, detail=f"Failed to download audio: {str(e)}")
 
 
-def analyze_audio_with_gemini(audio_path: str) -> Dict[str, Any]:
-    """Analyze audio file using Gemini"""
+# Markdown code fences (```json / ```JSON / bare ```) around Gemini's JSON, leading whitespace included
+_FENCE_RE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _parse_analysis(text: str) -> Optional[Dict[str, Any]]:
+    """Parse Gemini's JSON reply (None if it holds no valid JSON object)
+    
+    Strict orjson parsing is the fast path; if Gemini wrapped the JSON in prose,
+    the first complete object is decoded and the surrounding text ignored.
+    """
+    try:
+        # Clean up response if needed
+        analysis = orjson.loads(_FENCE_RE.sub("", text))
+    except orjson.JSONDecodeError as e:
+        error = e
+    else:
+        # Anything but an object can't be formatted (and must not be cached)
+        if isinstance(analysis, dict):
+            return analysis
+        logger.warning("Gemini reply is valid JSON but not an object: %.100s", text)
+        return None
+    
+    start = text.find("{")
+    if start != -1:
+        try:
+            analysis, _ = _JSON_DECODER.raw_decode(text, start)
+            logger.info("Recovered JSON object from Gemini reply with surrounding text")
+            return analysis
+        except json.JSONDecodeError as e:
+            error = e
+    
+    logger.warning("JSON parsing error: %s", error)
+    return None
+
+
+def _fallback_analysis() -> Dict[str, Any]:
+    """Default structure returned when Gemini's reply can't be parsed"""
+    return {
+        "transcription": [{"text": "Audio processed but could not parse response", "start_time": 0, "end_time": 1}],
+        "language": "unknown",
+        "speakers": [],
+        "summary": "Analysis failed",
+        "duration": 0
+    }
+
+
+def _analysis_cache_path(digest: Optional[str]) -> Optional[Path]:
+    """Cache file for this audio content + prompt (None if caching is disabled)"""
+    if not ANALYSIS_CACHE_DIR or digest is None:
+        return None
+    return Path(ANALYSIS_CACHE_DIR) / f"simple-{digest}-{PROMPT_HASH}.json"
+
+
+def _load_cached_analysis(cache_path: Optional[Path]) -> Optional[Dict[str, Any]]:
+    """Return a previously stored analysis, or None on miss (runs in a worker thread)"""
+    if cache_path is None:
+        return None
+    try:
+        analysis = orjson.loads(cache_path.read_bytes())
+        if not isinstance(analysis, dict):
+            # Unusable entry from before replies were checked; drop it
+            cache_path.unlink(missing_ok=True)
+            return None
+        os.utime(cache_path)  # Mark as recently used for the LRU sweep
+        return analysis
+    except (OSError, orjson.JSONDecodeError):
+        return None
+
+
+def _store_cached_analysis(cache_path: Optional[Path], analysis: Dict[str, Any]):
+    """Atomically write an analysis to the cache (best effort, runs in a worker thread)"""
+    if cache_path is None:
+        return
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(analysis))
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning("Could not write analysis cache %s: %s", cache_path, e)
+
+
+def _sweep_analysis_cache():
+    """Delete the least recently used cache entries beyond ANALYSIS_CACHE_MAX_FILES"""
+    try:
+        with os.scandir(ANALYSIS_CACHE_DIR) as entries:
+            files = [(entry.stat().st_mtime, entry.path) for entry in entries
+                     if entry.name.startswith("simple-") and entry.name.endswith(".json")]
+    except OSError:
+        return
+    
+    excess = len(files) - ANALYSIS_CACHE_MAX_FILES
+    if excess <= 0:
+        return
+    files.sort()
+    for _, path in files[:excess]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+# At most one LRU sweep runs at a time; they are started after cache writes
+_sweep_state = {"task": None}
+
+
+def _schedule_cache_sweep():
+    """Run the cache sweep in the background unless one is already running"""
+    task = _sweep_state["task"]
+    if task is None or task.done():
+        _sweep_state["task"] = asyncio.create_task(asyncio.to_thread(_sweep_analysis_cache))
+
+
+async def analyze_audio_with_gemini_async(audio_path: str, cache_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Analyze audio file using Gemini without blocking the event loop
+    
+    Successfully parsed analyses are written to `cache_path` when given.
+    """
     try:
         model = init_gemini()
         
-        # Upload audio file
-        audio_file = genai.upload_file(audio_path, mime_type="audio/mpeg")
+        # Upload audio file (the SDK only has a blocking upload)
+        audio_file = await asyncio.to_thread(genai.upload_file, audio_path, mime_type="audio/mpeg")
         
         # Generate analysis
-        response = model.generate_content([
-            ANALYSIS_PROMPT,
+        response = await model.generate_content_async([
+            ANALYSIS_PROMPT_PART,
             audio_file
         ])
         
-        # Parse JSON response
-        text = response.text.strip()
-        # Clean up response if needed
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-        
-        result = json.loads(text)
-        return result
-        
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {str(e)}")
-        # Return a default structure
-        return {
-            "transcription": [{"text": "Audio processed but could not parse response", "start_time": 0, "end_time": 1}],
-            "language": "unknown",
-            "speakers": [],
-            "summary": "Analysis failed",
-            "duration": 0
-        }
     except Exception as e:
-        print(f"Gemini analysis error: {str(e)}")
+        logger.warning("Gemini analysis error: %s", e)
+        raise HTTPException(status_code=500, detail=f"Gemini analysis failed: {str(e)}")
+    
+    analysis = _parse_analysis(response.text)
+    if analysis is None:
+        return _fallback_analysis()
+    
+    if cache_path is not None:
+        await asyncio.to_thread(_store_cached_analysis, cache_path, analysis)
+        _schedule_cache_sweep()
+    return analysis
+
+
+def analyze_audio_with_gemini(audio_path: str) -> Dict[str, Any]:
+    """Analyze audio file using Gemini (blocking; for scripts outside the event loop)
+    
+    Uses the SDK's synchronous calls: its async client is bound to the first event
+    loop, so running the async version with asyncio.run() fails on the second file.
+    """
+    try:
+        model = init_gemini()
+        audio_file = genai.upload_file(audio_path, mime_type="audio/mpeg")
+        response = model.generate_content([
+            ANALYSIS_PROMPT_PART,
+            audio_file
+        ])
+    except Exception as e:
+        logger.exception("Gemini analysis error: %s", e)
         raise HTTPException(status_code=500, detail=f"Gemini analysis failed: {str(e)}")
+    
+    analysis = _parse_analysis(response.text)
+    return analysis if analysis is not None else _fallback_analysis()
+
+
+# Constant fields of each prediction kind; only "value" differs per item
+_TRANSCRIPTION_TPL = {"from_name": "transcription", "to_name": "audio", "type": "textarea", "origin": "prediction"}
+_LANGUAGE_TPL = {"from_name": "language", "to_name": "audio", "type": "choices", "origin": "prediction"}
+_GENDER_TPL = {"from_name": "gender", "to_name": "audio", "type": "choices", "origin": "prediction"}
+_EMOTION_TPL = {"from_name": "emotion", "to_name": "audio", "type": "choices", "origin": "prediction"}
+_SUMMARY_TPL = {"from_name": "summary", "to_name": "audio", "type": "textarea", "origin": "prediction"}
 
 
 def format_label_studio_predictions(analysis: Dict[str, Any], task_id: int) -> Dict[str, Any]:
     """Convert Gemini analysis to Label Studio prediction format"""
     
-    predictions = []
-    
     # Add transcription
-    if analysis.get("transcription"):
-        for segment in analysis["transcription"]:
-            predictions.append({
-                "value": {
-                    "start": segment.get("start_time", 0),
-                    "end": segment.get("end_time", 0),
-                    "text": [segment.get("text", "")],
-                    "channel": 0
-                },
-                "from_name": "transcription",
-                "to_name": "audio",
-                "type": "textarea",
-                "origin": "prediction"
-            })
+    predictions = [
+        {**_TRANSCRIPTION_TPL, "value": {
+            "start": segment.get("start_time", 0),
+            "end": segment.get("end_time", 0),
+            "text": [segment.get("text", "")],
+            "channel": 0
+        }}
+        for segment in analysis.get("transcription") or ()
+    ]
     
     # Add language detection
     if analysis.get("language"):
-        predictions.append({
-            "value": {
-                "choices": [analysis["language"]]
-            },
-            "from_name": "language",
-            "to_name": "audio",
-            "type": "choices",
-            "origin": "prediction"
-        })
+        predictions.append({**_LANGUAGE_TPL, "value": {"choices": [analysis["language"]]}})
     
     # Add speaker labels
-    if analysis.get("speakers"):
-        for speaker in analysis["speakers"]:
-            if speaker.get("gender"):
-                predictions.append({
-                    "value": {
-                        "choices": [speaker["gender"]]
-                    },
-                    "from_name": "gender",
-                    "to_name": "audio",
-                    "type": "choices",
-                    "origin": "prediction"
-                })
-            
-            if speaker.get("emotion"):
-                predictions.append({
-                    "value": {
-                        "choices": [speaker["emotion"]]
-                    },
-                    "from_name": "emotion",
-                    "to_name": "audio",
-                    "type": "choices",
-                    "origin": "prediction"
-                })
+    for speaker in analysis.get("speakers") or ():
+        if speaker.get("gender"):
+            predictions.append({**_GENDER_TPL, "value": {"choices": [speaker["gender"]]}})
+        if speaker.get("emotion"):
+            predictions.append({**_EMOTION_TPL, "value": {"choices": [speaker["emotion"]]}})
     
     # Add summary
     if analysis.get("summary"):
-        predictions.append({
-            "value": {
-                "text": [analysis["summary"]]
-            },
-            "from_name": "summary",
-            "to_name": "audio",
-            "type": "textarea",
-            "origin": "prediction"
-        })
+        predictions.append({**_SUMMARY_TPL, "value": {"text": [analysis["summary"]]}})
     
     return {
         "result": predictions,
@@ -324,11 +667,80 @@ async def setup(request: Dict[str, Any]):
     }
 
 
-@app.post("/predict")
-async def predict(request: Dict[str, Any]):
+class PredictTask(BaseModel):
+    """A Label Studio task; only the id and audio reference are used"""
+    model_config = ConfigDict(extra="ignore")
+
+    id: int = 1
+    data: Dict[str, Any] = {}
+
+
+class PredictRequest(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    tasks: List[PredictTask]
+
+
+class PredictResponse(BaseModel):
+    results: List[Dict[str, Any]]
+
+
+async def _process_task(task: PredictTask) -> Optional[Dict[str, Any]]:
+    """Download, analyze and format a single Label Studio task"""
+    # Extract audio path
+    task_id = task.id
+    audio_url = task.data.get("audio")
+    
+    if not audio_url:
+        logger.warning("No audio URL in task %s", task_id)
+        return None
+    
+    logger.info("Processing task %s: %s", task_id, audio_url)
+    
+    async with _task_semaphore:
+        # Download audio
+        audio_path, is_temp, digest = await download_audio(audio_url)
+        
+        try:
+            # Audio analyzed before is served from the disk cache
+            cache_path = _analysis_cache_path(digest)
+            analysis = await asyncio.to_thread(_load_cached_analysis, cache_path)
+            if analysis is not None:
+                logger.info("Analysis cache hit for task %s", task_id)
+            else:
+                # Analyze with Gemini
+                analysis = await analyze_audio_with_gemini_async(audio_path, cache_path)
+        finally:
+            # Clean up temp file, never the original local audio
+            if is_temp:
+                os.unlink(audio_path)
+    
+    # Format for Label Studio
+    return format_label_studio_predictions(analysis, task_id)
+
+
+async def _process_task_safe(task: PredictTask) -> Optional[Dict[str, Any]]:
+    """Run _process_task, turning failures into an empty prediction"""
+    try:
+        return await _process_task(task)
+    except Exception as e:
+        logger.exception("Error processing task %s: %s", task.id, e)
+        # Add empty prediction on error
+        return {
+            "result": [],
+            "score": 0.0,
+            "model_version": "gemini-1.5-flash"
+        }
+
+
+@app.post("/predict", response_model=PredictResponse)
+async def predict(request: PredictRequest, stream: bool = False):
     """
     Generate predictions for Label Studio tasks
     
+    With ?stream=1 predictions are sent as newline-delimited JSON in completion
+    order, each tagged with its "task" id, instead of one aggregated response.
+    
     Expected format:
     {
         "tasks": [
@@ -342,55 +754,27 @@ async def predict(request: Dict[str, Any]):
     }
     """
     
-    # Validate request
-    if not request or "tasks" not in request:
-        raise HTTPException(status_code=422, detail="Request must contain 'tasks'")
-    
-    tasks = request.get("tasks", [])
+    # Validate request (missing or malformed 'tasks' is rejected by PredictRequest)
+    tasks = request.tasks
     if not tasks:
         raise HTTPException(status_code=422, detail="At least one task required")
     
-    results = []
+    if stream:
+        async def _tagged(task):
+            return task.id, await _process_task_safe(task)
+        
+        async def _ndjson():
+            for next_done in asyncio.as_completed([_tagged(task) for task in tasks]):
+                task_id, prediction = await next_done
+                if prediction is not None:
+                    yield orjson.dumps({"task": task_id, **prediction}) + b"\n"
+        
+        return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
     
-    for task in tasks:
-        try:
-            # Extract audio path
-            task_id = task.get("id", 1)
-            audio_url = task.get("data", {}).get("audio")
-            
-            if not audio_url:
-                print(f"No audio URL in task {task_id}")
-                continue
-            
-            print(f"Processing task {task_id}: {audio_url}")
-            
-            # Download audio
-            audio_path = await download_audio(audio_url)
-            
-            try:
-                # Analyze with Gemini
-                analysis = analyze_audio_with_gemini(audio_path)
-                
-                # Format for Label Studio
-                prediction = format_label_studio_predictions(analysis, task_id)
-                results.append(prediction)
-                
-            finally:
-                # Clean up temp file
-                if os.path.exists(audio_path):
-                    os.unlink(audio_path)
-            
-        except Exception as e:
-            print(f"Error processing task {task.get('id')}: {str(e)}")
-            # Add empty prediction on error
-            results.append({
-                "result": [],
-                "score": 0.0,
-                "model_version": "gemini-1.5-flash"
-            })
+    results = await asyncio.gather(*[_process_task_safe(task) for task in tasks])
     
     # Return in Label Studio format
-    return {"results": results}
+    return {"results": [prediction for prediction in results if prediction is not None]}
 
 
 @app.post("/train")
@@ -402,11 +786,12 @@ async def train(request: Dict[str, Any]):
 if __name__ == "__main__":
     # Check for API key
     if not GEMINI_API_KEY:
-        print("ERROR: GEMINI_API_KEY environment variable is required")
-        print("Set it with: export GEMINI_API_KEY=your_api_key_here")
+        logger.error("GEMINI_API_KEY environment variable is required")
+        logger.error("Set it with: export GEMINI_API_KEY=your_api_key_here")
         exit(1)
     
-    print(f"Starting Label Studio ML Backend on {HOST}:{PORT}")
-    print(f"Gemini API Key: {GEMINI_API_KEY[:20]}...")
+    logger.info("Starting Label Studio ML Backend on %s:%s", HOST, PORT)
+    logger.info("Gemini API Key: %.20s...", GEMINI_API_KEY)
     
+    # Development server; production runs under gunicorn (src/gunicorn_conf.py)
     uvicorn.run(app, host=HOST, port=PORT)
\ No newline at end of file
@@ -3,4 +3,10 @@ echo "Testing prediction endpoint..."
 curl -X POST http://localhost:9090/predict \
   -H "Content-Type: application/json" \
   -d '{"tasks": [{"id": 1, "data": {"audio": "/test.mp3"}}]}' \
-  2>/dev/null | python3 -m json.tool
\ No newline at end of file
+  2>/dev/null | python3 -m json.tool
+
+echo "Testing batch segment transcription endpoint..."
+curl -X POST http://localhost:9090/transcribe-segments \
+  -H "Content-Type: application/json" \
+  -d '[{"audio_url": "/test.mp3", "start_time": 0, "end_time": 2}, {"audio_url": "/test.mp3", "start_time": 2, "end_time": 4}]' \
+  2>/dev/null | python3 -m json.tool
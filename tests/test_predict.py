@@ -126,6 +126,45 @@ def test_predict_url():
     return False
 
 
+def test_transcribe_segments():
+    """Test batch segment transcription endpoint (enhanced API)"""
+    print("\nTesting /transcribe-segments endpoint...")
+    
+    # Two regions of the same audio; results come back in request order
+    request_data = [
+        {"audio_url": "/test.mp3", "start_time": 0.0, "end_time": 2.0},
+        {"audio_url": "/test.mp3", "start_time": 2.0, "end_time": 4.0}
+    ]
+    
+    print(f"Request: {json.dumps(request_data, indent=2)}")
+    
+    try:
+        response = requests.post(
+            f"{API_URL}/transcribe-segments",
+            json=request_data,
+            headers={"Content-Type": "application/json"},
+            timeout=60
+        )
+        
+        print(f"Status: {response.status_code}")
+        
+        if response.status_code == 200:
+            result = response.json()
+            print(f"Response: {json.dumps(result, indent=2)}")
+            
+            # One complete result per requested segment
+            if len(result) == len(request_data) and all("transcription" in item for item in result):
+                print("\n✅ Segment transcription successful!")
+                return True
+        else:
+            print(f"Error response: {response.text}")
+            
+    except Exception as e:
+        print(f"Error: {e}")
+    
+    return False
+
+
 def main():
     """Run all tests"""
     print(f"Testing ML Backend at {API_URL}")
@@ -144,6 +183,7 @@ def main():
         ("Health Check", test_health),
         ("API Info", test_info),
         ("Predict (Local)", test_predict_local),
+        ("Transcribe Segments", test_transcribe_segments),
         # ("Predict (URL)", test_predict_url),  # Optional: test with external URL
     ]
     